@@ -1,62 +1,34 @@
 import argparse
-import functools
-import multiprocessing
-import os
 import textwrap
-from hashlib import sha256
-from multiprocessing import Manager, Pool
 
 import pandas as pd
 import plotly.express as px
 import streamlit as st
-from datasets import get_dataset_infos
-from datasets.info import DatasetInfosDict
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import DjangoLexer
 
-from promptsource import DEFAULT_PROMPTSOURCE_CACHE_HOME
+from promptsource.overview import OverviewRefresher, get_overview
 from promptsource.session import _get_state
-from promptsource.templates import INCLUDED_USERS, LANGUAGES, METRICS, DatasetTemplates, Template, TemplateCollection
+from promptsource.templates import (
+    INCLUDED_USERS,
+    LANGUAGES,
+    METRICS,
+    DatasetTemplates,
+    RenderCache,
+    Template,
+    TemplateCollection,
+)
 from promptsource.utils import (
+    StreamingExamples,
     get_dataset,
     get_dataset_confs,
     list_datasets,
-    removeHyphen,
     renameDatasetColumn,
     render_features,
 )
 
 
-DATASET_INFOS_CACHE_DIR = os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "DATASET_INFOS")
-os.makedirs(DATASET_INFOS_CACHE_DIR, exist_ok=True)
-
-# Python 3.8 switched the default start method from fork to spawn. OS X also has
-# some issues related to fork, eee, e.g., https://github.com/bigscience-workshop/promptsource/issues/572
-# so we make sure we always use spawn for consistency
-multiprocessing.set_start_method("spawn", force=True)
-
-
-def get_infos(all_infos, d_name):
-    """
-    Wrapper for mutliprocess-loading of dataset infos
-
-    :param all_infos: multiprocess-safe dictionary
-    :param d_name: dataset name
-    """
-    d_name_bytes = d_name.encode("utf-8")
-    d_name_hash = sha256(d_name_bytes)
-    foldername = os.path.join(DATASET_INFOS_CACHE_DIR, d_name_hash.hexdigest())
-    if os.path.isdir(foldername):
-        infos_dict = DatasetInfosDict.from_directory(foldername)
-    else:
-        infos = get_dataset_infos(d_name)
-        infos_dict = DatasetInfosDict(infos)
-        os.makedirs(foldername)
-        infos_dict.write_to_directory(foldername)
-    all_infos[d_name] = infos_dict
-
-
 def format_language(tag):
     """
     Formats a language tag for display in the UI.
@@ -93,6 +65,32 @@ get_dataset_confs = st.cache(get_dataset_confs)
 list_datasets = st.cache(list_datasets)
 
 
+@st.cache(allow_output_mutation=True)
+def get_render_cache():
+    # Shared by reruns, so that the prompted examples of a page are only rendered once
+    return RenderCache()
+
+
+@st.cache(allow_output_mutation=True)
+def get_open_streams():
+    # Streams of examples read ahead, shared by reruns, so that they are closed once their
+    # split is not shown anymore
+    return []
+
+
+@st.cache(allow_output_mutation=True)
+def get_streaming_examples(dataset_key, subset_name, split):
+    # Shared by reruns, so that the examples read from the stream are kept when paging through them
+    dataset = get_dataset(dataset_key, subset_name, streaming=True)
+    return StreamingExamples(renameDatasetColumn(dataset[split]))
+
+
+@st.cache(allow_output_mutation=True)
+def get_overview_refresher():
+    # Shared by reruns, so that the metrics of the Helicopter view are refreshed by a single thread
+    return OverviewRefresher()
+
+
 def run_app():
     #
     # Loads session state
@@ -153,7 +151,6 @@ def run_app():
 
     if mode == "Helicopter view":
         st.title("High level metrics")
-        st.write("This will take a minute to collect.")
         st.write(
             "If you want to contribute, please refer to the instructions in "
             + "[Contributing](https://github.com/bigscience-workshop/promptsource/blob/main/CONTRIBUTING.md)."
@@ -184,55 +181,17 @@ def run_app():
         #
         # Metrics per dataset/subset
         #
-        # Download dataset infos (multiprocessing download)
-        manager = Manager()
-        all_infos = manager.dict()
-        all_datasets = list(set([t[0] for t in template_collection.keys]))
-
-        pool = Pool(processes=multiprocessing.cpu_count())
-        pool.map(functools.partial(get_infos, all_infos), all_datasets)
-        pool.close()
-        pool.join()
-
-        results = []
-        for dataset_name, subset_name in template_collection.keys:
-            # Collect split sizes (train, validation and test)
-            if dataset_name not in all_infos:
-                infos = get_dataset_infos(dataset_name)
-                all_infos[dataset_name] = infos
-            else:
-                infos = all_infos[dataset_name]
-            if infos:
-                if subset_name is None:
-                    subset_infos = infos[list(infos.keys())[0]]
-                else:
-                    subset_infos = infos[subset_name]
-
-                try:
-                    split_sizes = {k: v.num_examples for k, v in subset_infos.splits.items()}
-                except Exception:
-                    # Fixing bug in some community datasets.
-                    # For simplicity, just filling `split_sizes` with nothing, so the displayed split sizes will be 0.
-                    split_sizes = {}
-            else:
-                split_sizes = {}
-
-            # Collect template counts, original task counts and names
-            dataset_templates = template_collection.get_dataset(dataset_name, subset_name)
-            results.append(
-                {
-                    "Dataset name": dataset_name,
-                    "Subset name": "∅" if subset_name is None else subset_name,
-                    "Train size": split_sizes["train"] if "train" in split_sizes else 0,
-                    "Validation size": split_sizes["validation"] if "validation" in split_sizes else 0,
-                    "Test size": split_sizes["test"] if "test" in split_sizes else 0,
-                    "Number of prompts": len(dataset_templates),
-                    "Number of original task prompts": sum(
-                        [bool(t.metadata.original_task) for t in dataset_templates.templates.values()]
-                    ),
-                    "Prompt names": [t.name for t in dataset_templates.templates.values()],
-                }
+        # Metrics are read from the overview index, and the outdated ones are refreshed in
+        # the background
+        results, stale_datasets = get_overview(template_collection)
+        if get_overview_refresher().refresh(stale_datasets):
+            st.info(
+                f"Collecting the metrics of {len(stale_datasets)} dataset(s) in the background, "
+                "reload the page to see them."
             )
+        if not results:
+            st.stop()
+
         results_df = pd.DataFrame(results)
         results_df.sort_values(["Number of prompts"], inplace=True, ascending=False)
         results_df.reset_index(drop=True, inplace=True)
@@ -307,8 +266,13 @@ def run_app():
                 conf_option = st.sidebar.selectbox("Subset", configs, index=0, format_func=lambda a: a.name)
 
             subset_name = str(conf_option.name) if conf_option else None
+            streaming = st.sidebar.checkbox(
+                "Stream the dataset",
+                key="streaming_checkbox",
+                help="Read the examples on the fly instead of downloading the dataset, for large datasets.",
+            )
             try:
-                dataset = get_dataset(dataset_key, subset_name)
+                dataset = get_dataset(dataset_key, subset_name, streaming=streaming)
             except OSError as e:
                 st.error(
                     f"Some datasets are not handled automatically by `datasets` and require users to download the "
@@ -332,6 +296,18 @@ def run_app():
             split = st.sidebar.selectbox("Split", splits, key="split_select", index=index)
             dataset = dataset[split]
             dataset = renameDatasetColumn(dataset)
+            if streaming:
+                # Examples are read by index from the stream
+                examples = get_streaming_examples(dataset_key, subset_name, split)
+                open_streams = get_open_streams()
+                for stream in open_streams:
+                    if stream is not examples:
+                        stream.close()
+                open_streams[:] = [examples]
+                dataset_size = examples.length
+            else:
+                examples = dataset
+                dataset_size = len(dataset)
 
             #
             # Loads template data
@@ -366,9 +342,9 @@ def run_app():
 
                 step = 50
                 example_index = st.sidebar.number_input(
-                    f"Select the example index (Size = {len(dataset)})",
+                    f"Select the example index (Size = {'unknown' if dataset_size is None else dataset_size})",
                     min_value=0,
-                    max_value=len(dataset) - step,
+                    max_value=None if dataset_size is None else dataset_size - step,
                     value=0,
                     step=step,
                     key="example_index_number_input",
@@ -376,10 +352,16 @@ def run_app():
                 )
             else:  # mode = Sourcing
                 st.sidebar.subheader("Select Example")
-                example_index = st.sidebar.slider("Select the example index", 0, len(dataset) - 1)
+                if dataset_size is None:
+                    example_index = st.sidebar.number_input("Select the example index", min_value=0, value=0)
+                else:
+                    example_index = st.sidebar.slider("Select the example index", 0, dataset_size - 1)
 
-                example = dataset[example_index]
-                example = removeHyphen(example)
+                try:
+                    example = examples[example_index]
+                except IndexError as e:
+                    st.error(str(e))
+                    st.stop()
 
                 st.sidebar.write(example)
 
@@ -458,17 +440,19 @@ def run_app():
                 #
                 # Display a couple (steps) examples
                 #
-                for ex_idx in range(example_index, example_index + step):
-                    if ex_idx >= len(dataset):
-                        continue
-                    example = dataset[ex_idx]
-                    example = removeHyphen(example)
+                if streaming:
+                    page = examples.get(example_index, example_index + step)
+                else:
+                    page = [
+                        dataset[ex_idx] for ex_idx in range(example_index, min(example_index + step, len(dataset)))
+                    ]
+                for example in page:
                     col1, _, col2 = st.beta_columns([12, 1, 12])
                     with col1:
                         st.write(example)
                     if num_templates > 0:
                         with col2:
-                            prompt = template.apply(example, highlight_variables=False)
+                            prompt = get_render_cache().apply(template, example, highlight_variables=False)
                             if prompt == [""]:
                                 st.write("∅∅∅ *Blank result*")
                             else:
@@ -0,0 +1,52 @@
+#
+# Helpers for the files cached under DEFAULT_PROMPTSOURCE_CACHE_HOME, which are shared by
+# concurrent processes and threads
+#
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+
+def get_keyed_path(path: str, key: str) -> str:
+    """
+    Returns path with a hash of key added before its extension, e.g., so that a cache file is
+    specific to a templates folder or to an endpoint
+
+    :param path: path of the cache file, e.g., ~/.cache/promptsource/templates_index.pkl
+    :param key: string the cache file is specific to
+    :return: e.g., ~/.cache/promptsource/templates_index_0123456789abcdef.pkl
+    """
+    root, extension = os.path.splitext(path)
+    key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return f"{root}_{key_hash}{extension}"
+
+
+def discard_file(path: str) -> None:
+    """Removes a file if it exists and can be removed"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w") -> Iterator[IO]:
+    """
+    Opens a temporary file, which replaces the file at path once written, so that concurrent
+    readers never see a partial file. The folder of path is created if needed, and the
+    temporary file is removed if writing fails.
+
+    :param path: path of the written file
+    :param mode: "w" to write text in UTF-8, or "wb" to write bytes
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as tmp_file:
+            yield tmp_file
+        os.replace(tmp_path, path)
+    except BaseException:
+        discard_file(tmp_path)
+        raise
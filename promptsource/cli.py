@@ -0,0 +1,128 @@
+#
+# Command line interface of promptsource
+#
+# Usage: promptsource <command> [options], see promptsource --help
+#
+import argparse
+
+
+def export(args):
+    from promptsource.export import export_prompted_dataset
+
+    shard_paths = export_prompted_dataset(
+        args.dataset,
+        subset_name=args.subset,
+        template_names=args.template,
+        splits=args.split,
+        output_dir=args.output_dir,
+        output_format=args.format,
+        shard_size=args.shard_size,
+        chunk_size=args.chunk_size,
+        num_proc=args.num_proc,
+        max_examples=args.max_examples,
+        streaming=not args.no_streaming,
+        truncate=not args.no_truncate,
+    )
+    for split, paths in shard_paths.items():
+        print(f"{split}: {len(paths)} shard(s) written to {args.output_dir}")
+
+
+def precompile(args):
+    from promptsource import templates
+
+    if args.cache_dir is not None:
+        templates.enable_bytecode_cache(args.cache_dir)
+    if templates.env.bytecode_cache is None:
+        raise SystemExit("The bytecode cache is disabled, unset PROMPTSOURCE_BYTECODE_CACHE to enable it.")
+
+    count = templates.precompile_templates()
+    print(f"{count} prompts compiled to {templates.env.bytecode_cache.directory}")
+
+
+def snapshot_schemas(args):
+    from promptsource.schemas import SchemaSnapshot
+    from promptsource.templates import TemplateCollection
+
+    schemas = SchemaSnapshot(args.output)
+    failed = schemas.update(TemplateCollection().keys, max_workers=args.num_workers, refresh=args.refresh)
+    schemas.save()
+    print(f"{len(schemas)} dataset schemas written to {schemas.path}")
+    if failed:
+        raise SystemExit(f"Unable to load the schemas of {len(failed)} datasets: {failed}")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="promptsource", description="Tools for promptsource prompts.")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    export_parser = subparsers.add_parser(
+        "export", help="Apply prompts to a dataset and write the prompted examples to sharded files."
+    )
+    export_parser.add_argument("dataset", type=str, help="name of the dataset")
+    export_parser.add_argument("--subset", type=str, default=None, help="name of the subset")
+    export_parser.add_argument(
+        "--template",
+        type=str,
+        action="append",
+        default=None,
+        help="name of a prompt to apply, can be repeated. Defaults to all prompts of the dataset.",
+    )
+    export_parser.add_argument(
+        "--split", type=str, action="append", default=None, help="split to export, can be repeated. Defaults to all."
+    )
+    export_parser.add_argument("--output-dir", type=str, default=".", help="folder in which shards are written")
+    export_parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="format of the shards")
+    export_parser.add_argument(
+        "--shard-size", type=int, default=100000, help="maximum number of prompted examples per shard"
+    )
+    export_parser.add_argument(
+        "--chunk-size", type=int, default=1000, help="number of examples rendered together by a process"
+    )
+    export_parser.add_argument(
+        "--num-proc", type=int, default=None, help="number of rendering processes, defaults to the number of CPUs"
+    )
+    export_parser.add_argument(
+        "--max-examples", type=int, default=None, help="maximum number of examples exported per split"
+    )
+    export_parser.add_argument(
+        "--no-streaming", action="store_true", help="download the dataset instead of streaming it"
+    )
+    export_parser.add_argument(
+        "--no-truncate", action="store_true", help="do not truncate example fields to TEXT_VAR_LENGTH chars"
+    )
+    export_parser.set_defaults(func=export)
+
+    precompile_parser = subparsers.add_parser(
+        "precompile", help="Compile all prompts into the jinja bytecode cache shared by all processes."
+    )
+    precompile_parser.add_argument(
+        "--cache-dir", type=str, default=None, help="folder of the bytecode cache, defaults to ~/.cache/promptsource"
+    )
+    precompile_parser.set_defaults(func=precompile)
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot-schemas", help="Save the features of all the datasets with prompts, to validate prompts offline."
+    )
+    snapshot_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="path of the snapshot, defaults to $PROMPTSOURCE_SCHEMA_SNAPSHOT or ~/.cache/promptsource",
+    )
+    snapshot_parser.add_argument("--num-workers", type=int, default=8, help="number of datasets loaded in parallel")
+    snapshot_parser.add_argument(
+        "--refresh", action="store_true", help="load again the schemas which are already in the snapshot"
+    )
+    snapshot_parser.set_defaults(func=snapshot_schemas)
+
+    return parser
+
+
+def main(args=None):
+    args = get_parser().parse_args(args)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
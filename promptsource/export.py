@@ -0,0 +1,294 @@
+#
+# Export of prompted datasets: streams the outputs of Template.apply over the
+# examples of a dataset into sharded JSONL or Parquet files
+#
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from promptsource.templates import DatasetTemplates
+from promptsource.utils import get_dataset, get_projected_columns, project_dataset
+
+
+# Fields of the exported records
+RECORD_FIELDS = ("dataset", "subset", "split", "idx", "template_id", "template_name", "inputs", "targets")
+
+# Templates applied by the current process, set by _init_worker
+_worker_state = {}
+
+
+def _init_worker(dataset_name: str, subset_name: Optional[str], template_names: List[str], truncate: bool) -> None:
+    """
+    Loads the templates to apply in a rendering process
+
+    :param dataset_name: name of the dataset
+    :param subset_name: name of the subset
+    :param template_names: names of the templates to apply
+    :param truncate: if True, example fields are truncated to TEXT_VAR_LENGTH chars
+    """
+    dataset_templates = DatasetTemplates(dataset_name, subset_name)
+    _worker_state["dataset_name"] = dataset_name
+    _worker_state["subset_name"] = subset_name
+    _worker_state["templates"] = [dataset_templates[template_name] for template_name in template_names]
+    _worker_state["variables"] = dataset_templates.get_referenced_variables(template_names)
+    _worker_state["truncate"] = truncate
+
+
+def _render_chunk(split: str, start_idx: int, examples: List[Dict]) -> List[Dict]:
+    """
+    Applies the templates of the current process to a chunk of examples
+
+    :param split: name of the split the examples come from
+    :param start_idx: index of the first example of the chunk in the split
+    :param examples: list of examples
+    :return: list of records, ordered by example and then by template. Blank results are skipped.
+    """
+    # Only the fields referenced by the templates are passed to them, also when the columns
+    # of a streamed dataset are unknown and could not be projected when loading it
+    columns = get_projected_columns(examples[0], _worker_state["variables"])
+    batch = {key: [example[key] for example in examples] for key in columns}
+
+    # Seeds random choices with the example indices, so that exports are reproducible
+    seeds = list(range(start_idx, start_idx + len(examples)))
+    outputs = [
+        (template, template.apply_batch(batch, truncate=_worker_state["truncate"], seeds=seeds))
+        for template in _worker_state["templates"]
+    ]
+
+    records = []
+    for offset in range(len(examples)):
+        for template, output in outputs:
+            inputs, targets = output["inputs"][offset], output["targets"][offset]
+            if inputs == "" or targets == "":
+                continue
+            records.append(
+                {
+                    "dataset": _worker_state["dataset_name"],
+                    "subset": _worker_state["subset_name"],
+                    "split": split,
+                    "idx": start_idx + offset,
+                    "template_id": template.get_id(),
+                    "template_name": template.get_name(),
+                    "inputs": inputs,
+                    "targets": targets,
+                }
+            )
+    return records
+
+
+def _iter_chunks(examples: Iterable[Dict], chunk_size: int) -> Iterator[Tuple[int, List[Dict]]]:
+    """
+    Groups examples into chunks, without reading more than one chunk ahead
+
+    :return: iterator over tuples of the index of the first example of the chunk and the chunk
+    """
+    examples = iter(examples)
+    start_idx = 0
+    while True:
+        chunk = list(islice(examples, chunk_size))
+        if not chunk:
+            return
+        yield start_idx, chunk
+        start_idx += len(chunk)
+
+
+def _render_chunks(
+    split: str, chunks: Iterator[Tuple[int, List[Dict]]], initargs: Tuple, num_proc: int
+) -> Iterator[List[Dict]]:
+    """
+    Renders chunks of examples on a process pool, keeping at most 2 * num_proc chunks in
+    flight so that memory stays bounded whatever the size of the dataset
+
+    :return: iterator over the records of each chunk, in the order of the chunks
+    """
+    if num_proc <= 1:
+        _init_worker(*initargs)
+        for start_idx, chunk in chunks:
+            yield _render_chunk(split, start_idx, chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=num_proc, initializer=_init_worker, initargs=initargs) as executor:
+        pending = deque()
+        for start_idx, chunk in chunks:
+            if len(pending) >= 2 * num_proc:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_render_chunk, split, start_idx, chunk))
+        while pending:
+            yield pending.popleft().result()
+
+
+class ShardWriter(ABC):
+    """
+    Writes records to numbered shards of at most shard_size records each
+    """
+
+    extension = None
+
+    def __init__(self, output_dir: str, prefix: str, shard_size: int):
+        """
+        :param output_dir: folder in which shards are written
+        :param prefix: prefix of the shard file names
+        :param shard_size: maximum number of records per shard
+        """
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.paths = []
+        self._shard_records = 0
+
+    def write(self, records: List[Dict]) -> None:
+        while records:
+            if not self.paths or self._shard_records >= self.shard_size:
+                self._rotate()
+            count = self.shard_size - self._shard_records
+            self._write(records[:count])
+            self._shard_records += len(records[:count])
+            records = records[count:]
+
+    def close(self) -> None:
+        if self.paths:
+            self._close()
+
+    def _rotate(self) -> None:
+        if self.paths:
+            self._close()
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{self.prefix}-{len(self.paths):05d}.{self.extension}")
+        self.paths.append(path)
+        self._shard_records = 0
+        self._open(path)
+
+    @abstractmethod
+    def _open(self, path: str) -> None:
+        """Opens a new shard at path"""
+
+    @abstractmethod
+    def _write(self, records: List[Dict]) -> None:
+        """Writes records to the current shard"""
+
+    @abstractmethod
+    def _close(self) -> None:
+        """Closes the current shard"""
+
+
+class JsonlShardWriter(ShardWriter):
+    """
+    Writes records to JSON lines shards
+    """
+
+    extension = "jsonl"
+
+    def _open(self, path: str) -> None:
+        self._file = open(path, "w", encoding="utf-8")
+
+    def _write(self, records: List[Dict]) -> None:
+        self._file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class ParquetShardWriter(ShardWriter):
+    """
+    Writes records to Parquet shards, with one row group per written chunk of records
+    """
+
+    extension = "parquet"
+
+    def __init__(self, output_dir: str, prefix: str, shard_size: int):
+        import pyarrow as pa
+
+        super().__init__(output_dir, prefix, shard_size)
+        self._schema = pa.schema([(field, pa.int64() if field == "idx" else pa.string()) for field in RECORD_FIELDS])
+
+    def _open(self, path: str) -> None:
+        import pyarrow.parquet as pq
+
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def _write(self, records: List[Dict]) -> None:
+        import pyarrow as pa
+
+        columns = {field: [record[field] for record in records] for field in RECORD_FIELDS}
+        self._writer.write_table(pa.Table.from_pydict(columns, schema=self._schema))
+
+    def _close(self) -> None:
+        self._writer.close()
+
+
+SHARD_WRITERS = {"jsonl": JsonlShardWriter, "parquet": ParquetShardWriter}
+
+
+def export_prompted_dataset(
+    dataset_name: str,
+    subset_name: Optional[str] = None,
+    template_names: Optional[List[str]] = None,
+    splits: Optional[List[str]] = None,
+    output_dir: str = ".",
+    output_format: str = "jsonl",
+    shard_size: int = 100000,
+    chunk_size: int = 1000,
+    num_proc: Optional[int] = None,
+    max_examples: Optional[int] = None,
+    streaming: bool = True,
+    truncate: bool = True,
+) -> Dict[str, List[str]]:
+    """
+    Applies templates to the examples of a dataset and writes the prompted examples to
+    shards, in output_dir/<split>/<split>-<shard number>.<output_format>. Examples are
+    streamed and rendered in chunks, so only a bounded number of them are in memory.
+
+    :param dataset_name: name of the dataset
+    :param subset_name: name of the subset
+    :param template_names: names of the templates to apply, defaults to all templates of the dataset
+    :param splits: splits to export, defaults to all splits
+    :param output_dir: folder in which shards are written
+    :param output_format: "jsonl" or "parquet"
+    :param shard_size: maximum number of prompted examples per shard
+    :param chunk_size: number of examples rendered together by a process
+    :param num_proc: number of rendering processes, defaults to the number of CPUs
+    :param max_examples: if not None, maximum number of examples exported per split
+    :param streaming: if True, the dataset is streamed instead of downloaded
+    :param truncate: if True, example fields are truncated to TEXT_VAR_LENGTH chars
+    :return: dict of the paths of the written shards, keyed by split
+    """
+    if output_format not in SHARD_WRITERS:
+        raise ValueError(f"Unknown output format {output_format}, should be one of {sorted(SHARD_WRITERS)}.")
+
+    dataset_templates = DatasetTemplates(dataset_name, subset_name)
+    if template_names is None:
+        template_names = dataset_templates.all_template_names
+    for template_name in template_names:
+        if template_name not in dataset_templates.name_to_id_mapping:
+            raise ValueError(f"No template with name {template_name} for dataset {dataset_name} exists.")
+    if not template_names:
+        raise ValueError(f"No templates to apply for dataset {dataset_name}.")
+
+    # Only loads the columns referenced by the templates
+    variables = dataset_templates.get_referenced_variables(template_names)
+    dataset = project_dataset(get_dataset(dataset_name, subset_name, streaming=streaming), variables)
+    if splits is None:
+        splits = list(dataset.keys())
+
+    num_proc = os.cpu_count() if num_proc is None else num_proc
+    initargs = (dataset_name, subset_name, template_names, truncate)
+
+    shard_paths = {}
+    for split in splits:
+        examples = dataset[split]
+        if max_examples is not None:
+            examples = islice(examples, max_examples)
+
+        writer = SHARD_WRITERS[output_format](os.path.join(output_dir, split), split, shard_size)
+        try:
+            for records in _render_chunks(split, _iter_chunks(examples, chunk_size), initargs, num_proc):
+                writer.write(records)
+        finally:
+            writer.close()
+        shard_paths[split] = writer.paths
+
+    return shard_paths
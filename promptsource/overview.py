@@ -0,0 +1,270 @@
+#
+# Metrics of each (dataset, subset) shown by the Helicopter view of the app: split sizes
+# and template counts. They are persisted in a single index file, and only computed again
+# for the datasets whose templates.yaml files or dataset infos changed.
+#
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from datasets import get_dataset_infos
+from datasets.info import DatasetInfosDict
+
+import promptsource.templates
+from promptsource import DEFAULT_PROMPTSOURCE_CACHE_HOME
+from promptsource.cache import atomic_write, get_keyed_path
+from promptsource.templates import DatasetTemplates, TemplateCollection
+
+
+# Folder of the cached dataset infos, one sub-folder per dataset
+DATASET_INFOS_CACHE_DIR = os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "DATASET_INFOS")
+
+# Bumped whenever the format of the overview index changes
+OVERVIEW_INDEX_VERSION = 1
+
+# Serializes the updates of the overview index by the threads of a process
+_index_lock = threading.Lock()
+
+
+def get_overview_index_path() -> str:
+    # Overview indexes are specific to a templates folder
+    path = os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "overview_index.json")
+    return get_keyed_path(path, promptsource.templates.TEMPLATES_FOLDER_PATH)
+
+
+def get_infos_folder(dataset_name: str) -> str:
+    return os.path.join(DATASET_INFOS_CACHE_DIR, hashlib.sha256(dataset_name.encode("utf-8")).hexdigest())
+
+
+def load_dataset_infos(dataset_name: str) -> DatasetInfosDict:
+    """
+    Loads the infos of a dataset from the cache, or from the Hub, in which case they are cached
+
+    :param dataset_name: name of the dataset
+    :return: infos of each subset of the dataset
+    """
+    folder = get_infos_folder(dataset_name)
+    if os.path.isdir(folder):
+        return DatasetInfosDict.from_directory(folder)
+
+    infos_dict = DatasetInfosDict(get_dataset_infos(dataset_name))
+    os.makedirs(folder, exist_ok=True)
+    infos_dict.write_to_directory(folder)
+    return infos_dict
+
+
+def _get_fingerprint(dataset_name: str, subset_names: Iterable[Optional[str]]) -> Dict:
+    # The metrics of a dataset change with its templates.yaml files and its cached infos
+    files = {}
+    for subset_name in subset_names:
+        yaml_path = DatasetTemplates(dataset_name, subset_name, templates={}).yaml_path
+        try:
+            stat = os.stat(yaml_path)
+        except FileNotFoundError:
+            # Removed since the collection was loaded, which changes the fingerprint too
+            continue
+        files[yaml_path] = [stat.st_mtime_ns, stat.st_size]
+
+    folder = get_infos_folder(dataset_name)
+    infos_mtime = os.stat(folder).st_mtime_ns if os.path.isdir(folder) else None
+    return {"files": files, "infos": infos_mtime}
+
+
+def _get_split_sizes(infos: Optional[Dict], subset_name: Optional[str]) -> Dict[str, int]:
+    if not infos:
+        return {}
+    if subset_name is None:
+        subset_infos = infos[list(infos.keys())[0]]
+    else:
+        subset_infos = infos.get(subset_name)
+    try:
+        return {k: v.num_examples for k, v in subset_infos.splits.items()}
+    except Exception:
+        # Fixing bug in some community datasets.
+        # For simplicity, just filling `split_sizes` with nothing, so the displayed split sizes will be 0.
+        return {}
+
+
+def _get_row(dataset_templates: DatasetTemplates, split_sizes: Dict[str, int]) -> Dict:
+    templates = dataset_templates.templates.values()
+    return {
+        "Dataset name": dataset_templates.dataset_name,
+        "Subset name": "∅" if dataset_templates.subset_name is None else dataset_templates.subset_name,
+        "Train size": split_sizes.get("train", 0),
+        "Validation size": split_sizes.get("validation", 0),
+        "Test size": split_sizes.get("test", 0),
+        "Number of prompts": len(dataset_templates),
+        "Number of original task prompts": sum([bool(t.metadata.original_task) for t in templates]),
+        "Prompt names": [t.name for t in templates],
+    }
+
+
+def _group_subsets(template_collection: TemplateCollection) -> Dict[str, List[Optional[str]]]:
+    subsets = defaultdict(list)
+    for dataset_name, subset_name in template_collection.keys:
+        subsets[dataset_name].append(subset_name)
+    return subsets
+
+
+def read_overview_index(path: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    Reads the overview index
+
+    :param path: path of the index, defaults to get_overview_index_path()
+    :return: dict of the fingerprint and metric rows of each dataset, keyed by dataset name
+    """
+    path = path or get_overview_index_path()
+    try:
+        with open(path, "r", encoding="utf-8") as index_file:
+            index = json.load(index_file)
+        if index["version"] == OVERVIEW_INDEX_VERSION:
+            return index["datasets"]
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        logging.warning(f"Ignoring unreadable overview index {path}: {err}")
+    return {}
+
+
+def _write_overview_index(datasets: Dict[str, Dict], path: str) -> None:
+    # Atomically writes the index file, so that concurrent readers never see a partial file
+    try:
+        with atomic_write(path) as index_file:
+            json.dump({"version": OVERVIEW_INDEX_VERSION, "datasets": datasets}, index_file, ensure_ascii=False)
+    except OSError as err:
+        logging.warning(f"Unable to write overview index {path}: {err}")
+
+
+def get_overview(template_collection: TemplateCollection, path: Optional[str] = None):
+    """
+    Returns the metric rows of the overview index for the datasets of a template collection,
+    along with the datasets whose entries are missing or outdated
+
+    :param template_collection: templates to get the metrics of
+    :param path: path of the index, defaults to get_overview_index_path()
+    :return: tuple of the list of rows, one per (dataset, subset) with an entry in the index,
+             and of the list of names of the datasets to refresh with refresh_overview
+    """
+    index = read_overview_index(path)
+    rows, stale_datasets = [], []
+    for dataset_name, subset_names in _group_subsets(template_collection).items():
+        entry = index.get(dataset_name)
+        if entry is None or entry["fingerprint"] != _get_fingerprint(dataset_name, subset_names):
+            stale_datasets.append(dataset_name)
+        if entry is not None:
+            rows.extend(entry["rows"])
+    return rows, stale_datasets
+
+
+def refresh_overview(dataset_names: List[str], path: Optional[str] = None, max_workers: int = 8) -> List[str]:
+    """
+    Computes the metrics of datasets and writes them to the overview index. Dataset infos
+    are loaded on a thread pool, since loading them is bound by the requests to the Hub.
+
+    :param dataset_names: names of the datasets to refresh
+    :param path: path of the index, defaults to get_overview_index_path()
+    :param max_workers: number of threads loading dataset infos
+    :return: names of the datasets whose infos could not be loaded, which are not written
+    """
+    path = path or get_overview_index_path()
+    template_collection = TemplateCollection()
+    subsets = _group_subsets(template_collection)
+    dataset_names = [dataset_name for dataset_name in dataset_names if dataset_name in subsets]
+
+    def load(dataset_name):
+        try:
+            return load_dataset_infos(dataset_name)
+        except Exception as err:
+            logging.warning(f"Unable to load the infos of {dataset_name}: {err}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_infos = dict(zip(dataset_names, executor.map(load, dataset_names)))
+
+    entries, failed = {}, []
+    for dataset_name, infos in all_infos.items():
+        if infos is None:
+            failed.append(dataset_name)
+            continue
+        rows = []
+        for subset_name in subsets[dataset_name]:
+            dataset_templates = template_collection.get_dataset(dataset_name, subset_name)
+            rows.append(_get_row(dataset_templates, _get_split_sizes(infos, subset_name)))
+        entries[dataset_name] = {"fingerprint": _get_fingerprint(dataset_name, subsets[dataset_name]), "rows": rows}
+
+    if entries:
+        with _index_lock:
+            index = read_overview_index(path)
+            index.update(entries)
+            _write_overview_index(index, path)
+    return failed
+
+
+class OverviewRefresher:
+    """
+    Runs refresh_overview in a background thread, one refresh at a time. Datasets whose
+    infos could not be loaded are retried after a delay, which doubles after each failure.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_workers: int = 8,
+        retry_delay: float = 60.0,
+        max_retry_delay: float = 3600.0,
+    ):
+        self.path = path
+        self.max_workers = max_workers
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Time after which each failed dataset is retried, and the delay it was given
+        self.failed: Dict[str, Tuple[float, float]] = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self, dataset_names: List[str]) -> bool:
+        """
+        Starts refreshing datasets in the background, unless a refresh is already running
+
+        :param dataset_names: names of the datasets to refresh
+        :return: True if a refresh is running
+        """
+        with self._lock:
+            now = time.monotonic()
+            dataset_names = [
+                dataset_name
+                for dataset_name in dataset_names
+                if dataset_name not in self.failed or self.failed[dataset_name][0] <= now
+            ]
+            if not self.running and dataset_names:
+                self._thread = threading.Thread(target=self._run, args=(dataset_names,), daemon=True)
+                self._thread.start()
+            return self.running
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, dataset_names: List[str]) -> None:
+        failed = set(refresh_overview(dataset_names, self.path, self.max_workers))
+        with self._lock:
+            now = time.monotonic()
+            for dataset_name in dataset_names:
+                if dataset_name not in failed:
+                    self.failed.pop(dataset_name, None)
+                    continue
+                if dataset_name in self.failed:
+                    delay = min(2 * self.failed[dataset_name][1], self.max_retry_delay)
+                else:
+                    delay = self.retry_delay
+                self.failed[dataset_name] = (now + delay, delay)
@@ -0,0 +1,142 @@
+#
+# Snapshot of the schemas of the datasets with templates, so that templates are validated
+# against the features of their dataset without instantiating dataset builders, e.g., offline
+#
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from promptsource import DEFAULT_PROMPTSOURCE_CACHE_HOME
+from promptsource.cache import atomic_write
+from promptsource.utils import get_dataset_builder
+
+
+# Bumped whenever the format of the snapshot changes
+SCHEMA_SNAPSHOT_VERSION = 1
+
+
+def get_schema_snapshot_path() -> str:
+    """Path of the schema snapshot, which can be set with the environment variable PROMPTSOURCE_SCHEMA_SNAPSHOT"""
+    return os.environ.get(
+        "PROMPTSOURCE_SCHEMA_SNAPSHOT", os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "dataset_schemas.json")
+    )
+
+
+def load_features(dataset_name: str, subset_name: Optional[str] = None, max_tries: int = 3) -> Optional[Dict]:
+    """
+    Loads the features of a dataset from its builder, retrying on connection errors
+
+    :param dataset_name: name of the dataset
+    :param subset_name: name of the subset
+    :param max_tries: number of retries on connection errors
+    :return: features serialized with Features.to_dict, or None if the dataset does not declare any
+    """
+    tries = 0
+    while True:
+        try:
+            builder_instance = get_dataset_builder(dataset_name, subset_name)
+            break
+        except ConnectionError:
+            if tries < max_tries:
+                time.sleep(2)
+                tries += 1
+            else:
+                raise
+
+    features = builder_instance.info.features
+    return features.to_dict() if features is not None else None
+
+
+class SchemaSnapshot:
+    """
+    Features of datasets, keyed by (dataset_name, subset_name), persisted to a JSON file
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        :param path: path of the snapshot, defaults to get_schema_snapshot_path()
+        """
+        self.path = path or get_schema_snapshot_path()
+        self.schemas: Dict[Tuple[str, Optional[str]], Optional[Dict]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            if snapshot["version"] == SCHEMA_SNAPSHOT_VERSION:
+                for entry in snapshot["schemas"]:
+                    self.schemas[entry["dataset"], entry["subset"]] = entry["features"]
+            else:
+                logging.warning(f"Ignoring schema snapshot {self.path} with version {snapshot['version']}")
+
+    def __contains__(self, key: Tuple[str, Optional[str]]) -> bool:
+        return key in self.schemas
+
+    def __len__(self) -> int:
+        return len(self.schemas)
+
+    def get_features(self, dataset_name: str, subset_name: Optional[str] = None) -> Optional[Dict]:
+        """
+        Returns the features of a dataset in the snapshot
+
+        :return: features serialized with Features.to_dict, or None if the dataset does not declare any
+        """
+        if (dataset_name, subset_name) not in self.schemas:
+            raise KeyError(
+                f"No schema for {dataset_name}/{subset_name} in {self.path}, "
+                "run `promptsource snapshot-schemas` with network access to add it."
+            )
+        return self.schemas[dataset_name, subset_name]
+
+    def get_columns(self, dataset_name: str, subset_name: Optional[str] = None) -> Optional[Set[str]]:
+        """
+        Returns the names of the top-level features of a dataset in the snapshot
+
+        :return: set of strings, or None if the dataset does not declare any features
+        """
+        features = self.get_features(dataset_name, subset_name)
+        return set(features.keys()) if features is not None else None
+
+    def update(
+        self, keys: Iterable[Tuple[str, Optional[str]]], max_workers: int = 8, refresh: bool = False
+    ) -> List[Tuple[str, Optional[str]]]:
+        """
+        Loads the features of datasets from their builders on a thread pool and adds them to the
+        snapshot, without saving it
+
+        :param keys: list of (dataset_name, subset_name)
+        :param max_workers: number of threads loading features
+        :param refresh: if True, the features already in the snapshot are loaded again
+        :return: list of the keys whose features could not be loaded
+        """
+        keys = [key for key in keys if refresh or key not in self.schemas]
+
+        def load(key):
+            try:
+                return load_features(*key)
+            except Exception as err:
+                logging.warning(f"Unable to load the features of {key[0]}/{key[1]}: {err}")
+                return err
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for key, features in zip(keys, executor.map(load, keys)):
+                if isinstance(features, Exception):
+                    failed.append(key)
+                else:
+                    self.schemas[key] = features
+        return failed
+
+    def save(self) -> None:
+        """
+        Atomically writes the snapshot, sorted by dataset and subset so that it can be versioned
+        """
+        schemas = [
+            {"dataset": dataset_name, "subset": subset_name, "features": features}
+            for (dataset_name, subset_name), features in sorted(
+                self.schemas.items(), key=lambda item: (item[0][0], item[0][1] or "")
+            )
+        ]
+        with atomic_write(self.path) as snapshot_file:
+            json.dump({"version": SCHEMA_SNAPSHOT_VERSION, "schemas": schemas}, snapshot_file, indent=1)
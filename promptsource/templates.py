@@ -1,29 +1,138 @@
+import hashlib
+import json
 import logging
+import mmap
 import os
+import pickle
 import random
+import struct
+import sys
+import threading
 import uuid
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from shutil import rmtree
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, FrozenSet, Iterator, List, MutableMapping, NamedTuple, Optional, Set, Tuple
 
-import pandas as pd
-import pkg_resources
 import yaml
-from jinja2 import BaseLoader, Environment, meta
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, TemplateError, meta, nodes
+from jinja2.filters import do_truncate
+from jinja2.parser import Parser
+from jinja2.utils import LRUCache
+
+from promptsource import DEFAULT_PROMPTSOURCE_CACHE_HOME
+from promptsource.cache import atomic_write, get_keyed_path
+
+
+try:
+    from jinja2 import pass_context
+except ImportError:  # jinja2 < 3.0
+    from jinja2 import contextfilter as pass_context
 
 
 # Truncation of jinja template variables
 # 1710 = 300 words x 4.7 avg characters per word + 300 spaces
 TEXT_VAR_LENGTH = 2048
 
+# Maximum number of compiled jinja templates kept in memory, shared by all templates
+COMPILED_TEMPLATES_CACHE_SIZE = 4096
+
+# Jinja variable holding the rendered answer choices when they are rendered along with the prompt
+RENDERED_ANSWER_CHOICES = "__promptsource_answer_choices__"
+
+# Jinja variable holding the random number generator of the random filters, if seeded
+RNG_VARIABLE = "__promptsource_rng__"
+
+# Filters which draw randomly, making the templates using them non-deterministic
+RANDOM_FILTERS = frozenset({"choice", "random"})
+
+# Jinja variables holding the length to which variables are truncated, if any, and whether
+# they are highlighted, read by the output filter
+TRUNCATE_VARIABLE = "__promptsource_truncate__"
+HIGHLIGHT_VARIABLE = "__promptsource_highlight__"
+
+# Filter applied to the output of every expression of a prompt
+OUTPUT_FILTER = "__promptsource_output__"
+
+# Maximum number of times the fields of an example are truncated to fit a token budget
+TOKEN_BUDGET_MAX_ITERATIONS = 5
+
+
+def _get_templates_folder_path() -> str:
+    # importlib.resources is much faster to import than pkg_resources, which scans all the
+    # installed distributions, and the templates are always installed as files
+    try:
+        from importlib.resources import files
+    except ImportError:  # Python < 3.9
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+    return str(files(__package__) / "templates")
+
+
+# Whether the answer choices, metrics and languages of loaded templates are interned, since
+# the same strings are repeated by many templates. Enabled unless PROMPTSOURCE_INTERN_STRINGS is 0.
+INTERN_STRINGS = os.environ.get("PROMPTSOURCE_INTERN_STRINGS", "1") != "0"
+
 # Local path to the folder containing the templates
-TEMPLATES_FOLDER_PATH = pkg_resources.resource_filename(__name__, "templates")
+TEMPLATES_FOLDER_PATH = _get_templates_folder_path()
+
+# Loader for templates.yaml files, backed by libyaml when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# Loaders for which the !Template and !TemplateMetadata tags are registered
+YAML_LOADERS = [yaml.Loader, yaml.FullLoader, yaml.UnsafeLoader]
+if YAML_LOADER not in YAML_LOADERS:
+    YAML_LOADERS.append(YAML_LOADER)
 
 env = Environment(loader=BaseLoader)
 
 # Allow the python function zip()
 env.globals.update(zip=zip)
 
+# Compiled jinja templates of env, keyed by their source
+compiled_templates_cache = LRUCache(COMPILED_TEMPLATES_CACHE_SIZE)
+
+# Folder of the on-disk cache of compiled template code, shared by all processes
+BYTECODE_CACHE_DIR = os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "jinja_bytecode")
+
+# Bumped whenever templates are compiled differently, e.g., when _parse_template changes,
+# since the bytecode cache only tells apart the versions of jinja and of python
+BYTECODE_VERSION = 2
+
+
+class _BytecodeCache(FileSystemBytecodeCache):
+    """
+    Filesystem bytecode cache which creates its folder when first writing to it, and
+    which does not fail renderings when it cannot be written
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError as err:
+            logging.debug(f"Unable to write to the jinja bytecode cache {self.directory}: {err}")
+
+
+def enable_bytecode_cache(directory: Optional[str] = None) -> None:
+    """
+    Caches the code of the templates compiled with env on disk, keyed by the hash of their
+    source, so that each template is only compiled once across processes. The bytecode cache
+    is enabled by default, unless the environment variable PROMPTSOURCE_BYTECODE_CACHE is 0.
+
+    :param directory: folder of the cache, defaults to BYTECODE_CACHE_DIR
+    """
+    env.bytecode_cache = _BytecodeCache(directory or BYTECODE_CACHE_DIR)
+
+
+def disable_bytecode_cache() -> None:
+    """
+    Compiles templates without the on-disk cache of compiled code
+    """
+    env.bytecode_cache = None
+
+
+if os.environ.get("PROMPTSOURCE_BYTECODE_CACHE", "1") != "0":
+    enable_bytecode_cache()
+
 # These are users whose datasets should be included in the results returned by
 # filter_english_datasets (regardless of their metadata)
 INCLUDED_USERS = {"Zaid", "craffel"}
@@ -239,8 +348,26 @@ def highlight(input):
     return "<span style='color: #F08080'>" + input + "</span>"
 
 
-def choice(choices):
-    return random.choice(choices)
+def choice(choices, rng=None):
+    """Returns a random item, drawn with rng if not None and with the global generator otherwise"""
+    if rng is None:
+        rng = random
+    return rng.choice(choices)
+
+
+@pass_context
+def choice_filter(context, choices):
+    # Draws with the generator of the rendering, if any
+    return choice(choices, context.get(RNG_VARIABLE))
+
+
+@pass_context
+def random_filter(context, seq):
+    # Jinja's random filter, drawing with the generator of the rendering, if any
+    try:
+        return choice(seq, context.get(RNG_VARIABLE))
+    except IndexError:
+        return context.environment.undefined("No random item, sequence was empty.")
 
 
 def most_frequent(items):
@@ -253,17 +380,282 @@ def most_frequent(items):
     return most_frequent_items
 
 
+@pass_context
+def output_filter(context, value):
+    # Truncates and highlights the output of an expression according to the variables
+    # of the rendering, so that the same compiled template serves all renderings
+    length = context.get(TRUNCATE_VARIABLE)
+    if length is not None:
+        value = do_truncate(context.environment, str(value), length)
+    if context.get(HIGHLIGHT_VARIABLE):
+        value = highlight(str(value))
+    return value
+
+
 env.filters["highlight"] = highlight
-env.filters["choice"] = choice
+env.filters["choice"] = choice_filter
+env.filters["random"] = random_filter
+env.filters[OUTPUT_FILTER] = output_filter
 env.filters["most_frequent"] = most_frequent
 
 
+def compile_template(source, filter_outputs=False):
+    """
+    Compiles a jinja source with env, reusing the compiled template if the same
+    source was already compiled.
+
+    :param source: jinja source
+    :param filter_outputs: if True, the output of every expression goes through the output
+                           filter, which truncates and highlights it according to the
+                           variables TRUNCATE_VARIABLE and HIGHLIGHT_VARIABLE of the rendering
+    :return: compiled jinja template
+    """
+    key = (source, filter_outputs)
+    rtemplate = compiled_templates_cache.get(key)
+    if rtemplate is None:
+        rtemplate = _load_template(source, filter_outputs)
+        compiled_templates_cache[key] = rtemplate
+    return rtemplate
+
+
+class _OutputParser(Parser):
+    """
+    Jinja parser which records the expressions written in parentheses, to which a filter
+    written after them applies as a whole
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parenthesized = set()
+
+    def parse_primary(self, *args, **kwargs):
+        parenthesized = self.stream.current.type == "lparen"
+        node = super().parse_primary(*args, **kwargs)
+        if parenthesized:
+            self.parenthesized.add(id(node))
+        return node
+
+
+def _filter_output(node, parenthesized):
+    # Wraps an expression in the output filter the way a filter written at its end binds to
+    # it, i.e., to the last operand of operators and to the last branch of conditions, as
+    # "{{ a if b else c | highlight }}" only highlights c
+    if id(node) in parenthesized:
+        node = nodes.Filter(node, OUTPUT_FILTER, [], [], None, None, lineno=node.lineno)
+    elif isinstance(node, (nodes.BinExpr, nodes.Not)):
+        if isinstance(node, nodes.Not):
+            node.node = _filter_output(node.node, parenthesized)
+        else:
+            node.right = _filter_output(node.right, parenthesized)
+    elif isinstance(node, nodes.Compare) and node.ops:
+        node.ops[-1].expr = _filter_output(node.ops[-1].expr, parenthesized)
+    elif isinstance(node, nodes.Concat):
+        node.nodes[-1] = _filter_output(node.nodes[-1], parenthesized)
+    elif isinstance(node, nodes.CondExpr):
+        if node.expr2 is not None:
+            node.expr2 = _filter_output(node.expr2, parenthesized)
+        else:
+            node.test = _filter_output(node.test, parenthesized)
+    else:
+        node = nodes.Filter(node, OUTPUT_FILTER, [], [], None, None, lineno=node.lineno)
+    return node
+
+
+def _parse_template(source, filter_outputs):
+    # Parses a jinja source, wrapping the expressions of its outputs in the output filter
+    # if requested. The answer choices rendered along with a prompt are left as they are.
+    if not filter_outputs:
+        return env.parse(source)
+    parser = _OutputParser(env, source)
+    tree = parser.parse()
+    skipped = set()
+    for block in tree.find_all(nodes.AssignBlock):
+        if isinstance(block.target, nodes.Name) and block.target.name == RENDERED_ANSWER_CHOICES:
+            skipped.update(id(output) for output in block.find_all(nodes.Output))
+
+    for output in list(tree.find_all(nodes.Output)):
+        if id(output) not in skipped:
+            output.nodes = [
+                node if isinstance(node, nodes.TemplateData) else _filter_output(node, parser.parenthesized)
+                for node in output.nodes
+            ]
+    tree.set_environment(env)
+    return tree
+
+
+def _load_template(source, filter_outputs=False):
+    # Same as env.from_string, but with the compiled code loaded from and saved to the
+    # bytecode cache, the same way jinja loaders do
+    bytecode_cache = env.bytecode_cache
+    if bytecode_cache is None:
+        code = env.compile(_parse_template(source, filter_outputs))
+    else:
+        name = source if not filter_outputs else f"{OUTPUT_FILTER}\n{source}"
+        name = hashlib.sha256(f"{BYTECODE_VERSION}\n{name}".encode("utf-8")).hexdigest()
+        bucket = bytecode_cache.get_bucket(env, name, None, source)
+        code = bucket.code
+        if code is None:
+            code = env.compile(_parse_template(source, filter_outputs))
+            bucket.code = code
+            bytecode_cache.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+
+class TemplateAnalysis(NamedTuple):
+    """
+    Static analysis of the Jinja and of the answer choices of a template
+    """
+
+    # Example fields referenced by the template
+    variables: FrozenSet[str]
+    # Jinja filters used by the template
+    filters: FrozenSet[str]
+    # Whether the template does not draw randomly with one of RANDOM_FILTERS
+    deterministic: bool
+    # Answer choices if they are the same for every example, None otherwise
+    fixed_answer_choices: Optional[Tuple[str, ...]]
+    # Number of answer choices if it is the same for every example, None otherwise
+    num_answer_choices: Optional[int]
+
+
+def _get_loaded_names(*parse_nodes):
+    # Names of the variables read by parsed nodes
+    names = set()
+    for node in parse_nodes:
+        if isinstance(node, nodes.Name) and node.ctx == "load":
+            names.add(node.name)
+        elif isinstance(node, nodes.Node):
+            names.update(name.name for name in node.find_all(nodes.Name) if name.ctx == "load")
+    return names
+
+
+def _get_variable_sources(parse):
+    # Maps each variable set by a template, e.g., with set, for, a namespace, a macro or a
+    # method call such as append, to the variables its value is computed from
+    sources = defaultdict(set)
+
+    def get_targets(target):
+        # Names set by an assignment target, e.g., x, (x, y) or ns.attr
+        target_nodes = [target, *target.find_all((nodes.Name, nodes.NSRef))]
+        return {node.name for node in target_nodes if isinstance(node, (nodes.Name, nodes.NSRef))}
+
+    for node in parse.find_all((nodes.Assign, nodes.AssignBlock, nodes.For, nodes.With, nodes.Macro, nodes.Call)):
+        if isinstance(node, nodes.Assign):
+            edges = [(get_targets(node.target), _get_loaded_names(node.node))]
+        elif isinstance(node, nodes.AssignBlock):
+            edges = [(get_targets(node.target), _get_loaded_names(node.filter, *node.body))]
+        elif isinstance(node, nodes.For):
+            edges = [(get_targets(node.target), _get_loaded_names(node.iter, node.test))]
+        elif isinstance(node, nodes.With):
+            edges = [
+                (get_targets(target), _get_loaded_names(value)) for target, value in zip(node.targets, node.values)
+            ]
+        elif isinstance(node, nodes.Macro):
+            edges = [({node.name}, _get_loaded_names(*node.defaults, *node.body))]
+        elif isinstance(node.node, nodes.Getattr) and isinstance(node.node.node, nodes.Name):
+            # The method may store its arguments in the object, e.g., list.append
+            arguments = [*node.args, *(kwarg.value for kwarg in node.kwargs), node.dyn_args, node.dyn_kwargs]
+            edges = [({node.node.node.name}, _get_loaded_names(*arguments))]
+        else:
+            continue
+        for targets, loaded in edges:
+            for target in targets:
+                sources[target] |= loaded
+    return sources
+
+
+def _get_prompt_only_variables(parse):
+    # Returns the variables whose value is rendered by the outputs before the first separator
+    # of a parsed template, and that are not read after it, directly or through the variables
+    # set from them, walking the nodes in the order of the source so that the separator can be
+    # inside a Jinja block. Returns None if no text of the template contains a separator.
+    rendered, after = set(), set()
+    separator_found = False
+
+    def visit(node, in_output):
+        nonlocal separator_found
+        if isinstance(node, nodes.TemplateData):
+            separator_found = separator_found or "|||" in node.data
+        elif isinstance(node, nodes.Name) and node.ctx == "load":
+            if separator_found:
+                after.add(node.name)
+            elif in_output:
+                rendered.add(node.name)
+        for child in node.iter_child_nodes():
+            visit(child, in_output or isinstance(node, nodes.Output))
+
+    visit(parse, False)
+    if not separator_found:
+        return None
+
+    sources = _get_variable_sources(parse)
+
+    def expand(names):
+        # Adds the variables the names are computed from, transitively
+        names, pending = set(names), list(names)
+        while pending:
+            for source in sources.get(pending.pop(), ()):
+                if source not in names:
+                    names.add(source)
+                    pending.append(source)
+        return names
+
+    return (expand(rendered) - expand(after)) & meta.find_undeclared_variables(parse)
+
+
+def _count_answer_choices(parse):
+    # Counts the answer choices of a parsed answer choices expression, if all the separators
+    # are in its text, outside of any control structure. The separators in the values of
+    # variables are escaped when rendering answer choices.
+    count = 1
+    for output in parse.body:
+        if not isinstance(output, nodes.Output):
+            return None
+        for node in output.nodes:
+            if isinstance(node, nodes.TemplateData):
+                count += node.data.count("|||")
+            elif isinstance(node, nodes.Const):
+                if "|||" in str(node.value):
+                    return None
+            elif not isinstance(node, (nodes.Name, nodes.Getattr, nodes.Getitem)):
+                return None
+    return count
+
+
+def _get_slots_state(obj) -> Dict:
+    # State of a Template or Metadata, i.e., its public slots and the unknown keys of the YAML
+    # file it was read from, so that they are written back
+    state = {key: getattr(obj, key) for key in obj.__slots__ if not key.startswith("_")}
+    if obj._extra:
+        state.update(obj._extra)
+    return state
+
+
+def _set_slots_state(obj, state: Dict) -> None:
+    # Restores the state of a Template or Metadata, where missing keys default to None
+    extra = {}
+    for key in obj.__slots__:
+        if not key.startswith("_"):
+            setattr(obj, key, None)
+    for key, value in state.items():
+        if key in obj.__slots__ and not key.startswith("_"):
+            setattr(obj, key, value)
+        else:
+            extra[key] = value
+    obj._extra = extra or None
+
+
 class Template(yaml.YAMLObject):
     """
     A prompt template.
     """
 
     yaml_tag = "!Template"
+    yaml_loader = YAML_LOADERS
+
+    # Templates have no __dict__, so that the thousands of templates of a TemplateCollection
+    # take less memory, and fewer pages are copied by forked processes updating refcounts
+    __slots__ = ("id", "name", "jinja", "reference", "metadata", "answer_choices", "_extra", "_cache")
 
     def __init__(self, name, jinja, reference, metadata=None, answer_choices=None):
         """
@@ -293,6 +685,126 @@ class Template(yaml.YAMLObject):
         self.reference = reference
         self.metadata = metadata if metadata is not None else Template.Metadata()
         self.answer_choices = answer_choices
+        self._extra = None
+        self._cache = {}
+
+    def __getstate__(self):
+        # The cache holds compiled templates, so it is neither dumped to YAML nor pickled
+        return _get_slots_state(self)
+
+    def __setstate__(self, state):
+        _set_slots_state(self, state)
+        if INTERN_STRINGS and self.answer_choices is not None:
+            self.answer_choices = sys.intern(self.answer_choices)
+        self._cache = {}
+
+    def clear_cache(self):
+        """
+        Drops the compiled jinja templates and precomputed answer choices held by this
+        template. Needs to be called when jinja or answer_choices are edited.
+        """
+        self._cache = {}
+
+    def _get_compiled(self, jinja, filter_outputs=False, answer_choices=None):
+        """
+        Returns the compiled jinja template for a jinja source of this template
+
+        :param jinja: jinja source, i.e., self.jinja or self.answer_choices
+        :param filter_outputs: if True, the outputs of expressions are truncated and
+                               highlighted as requested by the rendering, see compile_template
+        :param answer_choices: if not None, jinja expression for answer choices which is
+                               rendered in the same pass as jinja, into the variable
+                               `answer_choices`
+        :return: compiled jinja template
+        """
+        key = (jinja, filter_outputs, answer_choices)
+        rtemplate = self._cache.get(key)
+        if rtemplate is None:
+            # Renders the answer choices first, without truncation or highlighting
+            if answer_choices is not None:
+                jinja = (
+                    f"{{% set {RENDERED_ANSWER_CHOICES} %}}{answer_choices}{{% endset %}}"
+                    f"{{% set answer_choices = {RENDERED_ANSWER_CHOICES}.split('|||') | map('trim') | list %}}"
+                ) + jinja
+
+            rtemplate = compile_template(jinja, filter_outputs)
+            self._cache[key] = rtemplate
+        return rtemplate
+
+    def _get_compiled_prompt(self):
+        """
+        Returns the compiled jinja template for the prompt, along with the answer choices
+        if they are fixed. Otherwise, the answer choices are rendered by the compiled
+        template itself. The same compiled template is used whether variables are
+        truncated and highlighted or not, see _get_rendering_variables.
+
+        :return: tuple of compiled jinja template and list of answer choices or None
+        """
+        answer_choices = self._get_fixed_answer_choices()
+        if answer_choices is None and self.answer_choices is not None:
+            rtemplate = self._get_compiled(self.jinja, True, self.answer_choices)
+        else:
+            rtemplate = self._get_compiled(self.jinja, True)
+        return rtemplate, answer_choices
+
+    @staticmethod
+    def _get_rendering_variables(truncate, highlight_variables, text_var_length):
+        # Jinja variables read by the output filter of the compiled prompt
+        variables = {}
+        if truncate:
+            variables[TRUNCATE_VARIABLE] = TEXT_VAR_LENGTH if text_var_length is None else text_var_length
+        if highlight_variables:
+            variables[HIGHLIGHT_VARIABLE] = True
+        return variables
+
+    def _get_fixed_answer_choices(self):
+        # Answer choices which are the same for every example are precomputed once. Answer
+        # choices drawing randomly with one of RANDOM_FILTERS are not fixed.
+        key = ("fixed_answer_choices", self.answer_choices)
+        if key not in self._cache:
+            answer_choices = self.get_analysis().fixed_answer_choices
+            self._cache[key] = list(answer_choices) if answer_choices is not None else None
+        return self._cache[key]
+
+    def get_analysis(self):
+        """
+        Returns the static analysis of the Jinja and of the answer choices of the template,
+        which only parses them once
+
+        :return: TemplateAnalysis
+        """
+        key = ("analysis", self.jinja, self.answer_choices)
+        if key not in self._cache:
+            parse = env.parse(self.jinja)
+            variables = meta.find_undeclared_variables(parse)
+            filters = {node.name for node in parse.find_all(nodes.Filter)}
+
+            fixed_answer_choices, num_answer_choices = None, None
+            if self.answer_choices is not None:
+                parse = env.parse(self.answer_choices)
+                answer_choices_variables = meta.find_undeclared_variables(parse)
+                answer_choices_filters = {node.name for node in parse.find_all(nodes.Filter)}
+                if not answer_choices_variables and answer_choices_filters.isdisjoint(RANDOM_FILTERS):
+                    rendered_choices = self._get_compiled(self.answer_choices).render()
+                    fixed_answer_choices = tuple(choice.strip() for choice in rendered_choices.split("|||"))
+                    num_answer_choices = len(fixed_answer_choices)
+                else:
+                    num_answer_choices = _count_answer_choices(parse)
+                variables |= answer_choices_variables
+                filters |= answer_choices_filters
+
+            self._cache[key] = TemplateAnalysis(
+                variables=frozenset(variables - {"answer_choices"}),
+                filters=frozenset(filters),
+                deterministic=filters.isdisjoint(RANDOM_FILTERS),
+                fixed_answer_choices=fixed_answer_choices,
+                num_answer_choices=num_answer_choices,
+            )
+        return self._cache[key]
+
+    def _set_analysis(self, analysis):
+        # Sets the analysis of the template, e.g., precomputed in the templates index
+        self._cache[("analysis", self.jinja, self.answer_choices)] = analysis
 
     def get_id(self):
         """
@@ -336,11 +848,60 @@ class Template(yaml.YAMLObject):
         if jinja is None:
             return None
 
-        rtemplate = env.from_string(jinja)
+        rtemplate = self._get_compiled(jinja)
         protected_example = self._escape_pipe(example)
         rendered_choices = rtemplate.render(**protected_example)
         return [self._unescape_pipe(answer_choice.strip()) for answer_choice in rendered_choices.split("|||")]
 
+    def get_referenced_variables(self):
+        """
+        Returns the names of the example fields referenced by the template, either in its
+        Jinja or in its answer choices
+
+        :return: frozenset of strings
+        """
+        return self.get_analysis().variables
+
+    def get_variable_keys(self, example):
+        """
+        Returns the keys of the example fields referenced by the template. Jinja variables
+        cannot contain hyphens, so a variable such as `a_b` reads the field `a-b` of examples
+        whose columns were not renamed with utils.renameDatasetColumn. The keys found for
+        hyphenated fields are reused as long as they match the examples, and are searched
+        again for the variables missing from the previous examples.
+
+        :param example: the dataset example, or a batch in columnar format
+        :return: dict mapping each referenced variable found in the example to its key
+        """
+        variables = self.get_referenced_variables()
+        key = ("variable_keys", self.jinja, self.answer_choices)
+        variable_keys = self._cache.get(key)
+        if variable_keys is None:
+            variable_keys = self._cache[key] = {variable: variable for variable in variables}
+
+        # Checks that the fields found in the previous example are present in this one, and
+        # searches again for the missing ones, which may be in this example under another key
+        if not all(variable in variable_keys and variable_keys[variable] in example for variable in variables):
+            hyphenated_keys = {field.replace("-", "_"): field for field in example if "-" in field}
+            variable_keys = {}
+            for variable in variables:
+                if variable in example:
+                    variable_keys[variable] = variable
+                elif variable in hyphenated_keys:
+                    variable_keys[variable] = hyphenated_keys[variable]
+            self._cache[key] = variable_keys
+        return variable_keys
+
+    def is_deterministic(self):
+        """
+        Returns whether applying the template to an example always creates the same prompt,
+        i.e., whether neither its Jinja nor its answer choices use a random filter, such as
+        choice or random
+
+        :return: bool
+        """
+        return self.get_analysis().deterministic
+
     def get_fixed_answer_choices_list(self):
         """
         Returns a list of answer choices that is static across examples, if possible
@@ -350,52 +911,236 @@ class Template(yaml.YAMLObject):
         if jinja is None:
             return None
 
+        analysis = self.get_analysis()
+        if analysis.fixed_answer_choices is not None:
+            return list(analysis.fixed_answer_choices)
+        if analysis.deterministic:
+            # The answer choices depend on the example
+            return None
+
+        # The answer choices may be drawn randomly without depending on the example
         parse = env.parse(jinja)
         variables = meta.find_undeclared_variables(parse)
         if len(variables) == 0:
-            rtemplate = env.from_string(jinja)
+            rtemplate = self._get_compiled(jinja)
             rendered_choices = rtemplate.render()
             return [answer_choice.strip() for answer_choice in rendered_choices.split("|||")]
         else:
             return None
 
-    def apply(self, example, truncate=True, highlight_variables=False):
+    def get_rng(self, seed):
+        """
+        Returns a random number generator for rendering this template with a seed. The
+        generator only depends on the template id and the seed, so it draws the same
+        numbers in any process.
+
+        :param seed: seed, e.g., the index of the example
+        :return: random.Random instance
+        """
+        return random.Random(f"{self.get_id()}-{seed}")
+
+    def apply(
+        self,
+        example,
+        truncate=True,
+        highlight_variables=False,
+        seed=None,
+        text_var_length=None,
+        token_budget=None,
+        tokenizer=None,
+    ):
         """
         Creates a prompt by applying this template to an example
 
         :param example: the dataset example to create a prompt for
         :param truncate: if True, example fields will be truncated to TEXT_VAR_LENGTH chars
         :param highlight_variables: highlight the added variables
+        :param seed: if not None, the random choices of the template (choice and random
+                     filters) are drawn from a generator seeded with the template id and this
+                     seed, e.g., the index of the example, so that the prompt is reproducible
+        :param text_var_length: if not None, number of chars example fields are truncated to
+                                instead of TEXT_VAR_LENGTH
+        :param token_budget: if not None, maximum number of tokens of the prompt. The longest
+                             fields of the example used by the prompt are truncated first until
+                             the prompt fits, see _fit_token_budget.
+        :param tokenizer: callable mapping a list of strings to the list of their tokens,
+                          e.g., `lambda texts: tokenizer(texts)["input_ids"]` with a Hugging
+                          Face tokenizer. Required with token_budget.
         :return: tuple of 2 strings, for prompt and output
         """
-        jinja = self.jinja
+        if token_budget is not None and tokenizer is None:
+            raise ValueError("A tokenizer is required to truncate prompts to a token budget.")
 
-        # Truncates the prompt if needed
-        if truncate:
-            trunc_command = (
-                f" | string | truncate({TEXT_VAR_LENGTH}) }}}}"  # Escaping curly braces requires doubling them
-            )
-            jinja = jinja.replace("}}", trunc_command)
+        rtemplate, answer_choices = self._get_compiled_prompt()
 
-        # Highlights text that was substituted for variables, if requested
-        if highlight_variables:
-            jinja = jinja.replace("}}", " | highlight }}")
-        rtemplate = env.from_string(jinja)
-
-        protected_example = self._escape_pipe(example)
-
-        # Adds in answer_choices variable
-        if "answer_choices" in protected_example:
+        if "answer_choices" in example:
             raise ValueError("Example contains the restricted key 'answer_choices'.")
 
-        protected_example["answer_choices"] = self.get_answer_choices_list(example)
+        # Only the fields referenced by the template are passed to Jinja
+        protected_example, escaped = self._escape_pipe_variables(example, self.get_variable_keys(example))
+
+        # Adds in answer_choices variable, unless rendered along with the prompt
+        protected_example["answer_choices"] = answer_choices
+        protected_example.update(self._get_rendering_variables(truncate, highlight_variables, text_var_length))
+        if seed is not None:
+            protected_example[RNG_VARIABLE] = self.get_rng(seed)
 
         # Renders the Jinja template
         rendered_example = rtemplate.render(**protected_example)
 
         # Splits on the separator, and then replaces back any occurrences of the
         # separator in the original example
-        return [self._unescape_pipe(part).strip() for part in rendered_example.split("|||")]
+        parts = self._split_rendered(rendered_example, escaped)
+
+        if token_budget is not None:
+            results = [parts]
+            self._fit_token_budget(rtemplate, [protected_example], [seed], escaped, results, token_budget, tokenizer)
+            parts = results[0]
+        return parts
+
+    def apply_batch(
+        self,
+        batch,
+        *,
+        truncate=True,
+        highlight_variables=False,
+        seeds=None,
+        text_var_length=None,
+        token_budget=None,
+        tokenizer=None,
+    ):
+        """
+        Creates prompts by applying this template to a batch of examples in the columnar
+        format of the Hugging Face datasets library, e.g., with `Dataset.map(batched=True)`.
+        The arguments after the batch are keyword-only, since map passes the indices of the
+        examples as the second positional argument when with_indices is True.
+
+        :param batch: dictionary mapping each field to the list of its values in the batch
+        :param truncate: if True, example fields will be truncated to TEXT_VAR_LENGTH chars
+        :param highlight_variables: highlight the added variables
+        :param seeds: if not None, list of seeds of the examples, as the seed of apply, e.g.,
+                      the indices given by `Dataset.map(batched=True, with_indices=True)` to
+                      `lambda batch, indices: template.apply_batch(batch, seeds=indices)`
+        :param text_var_length: if not None, number of chars example fields are truncated to
+                                instead of TEXT_VAR_LENGTH
+        :param token_budget: if not None, maximum number of tokens of the prompts, as in apply.
+                             The tokenizer is called once for all the examples of the batch.
+        :param tokenizer: callable mapping a list of strings to the list of their tokens
+        :return: dictionary with the parallel lists "inputs" and "targets" of prompts and outputs
+        """
+        if "answer_choices" in batch:
+            raise ValueError("Batch contains the restricted key 'answer_choices'.")
+        if token_budget is not None and tokenizer is None:
+            raise ValueError("A tokenizer is required to truncate prompts to a token budget.")
+
+        rtemplate, answer_choices = self._get_compiled_prompt()
+        rendering_variables = self._get_rendering_variables(truncate, highlight_variables, text_var_length)
+
+        # Only the columns referenced by the template are passed to Jinja
+        columns = {variable: batch[key] for variable, key in self.get_variable_keys(batch).items()}
+        protected_columns, escaped = self._escape_pipe_batch(columns)
+        batch_size = len(next(iter(batch.values()))) if batch else 0
+
+        protected_examples, results = [], []
+        for i in range(batch_size):
+            protected_example = {key: values[i] for key, values in protected_columns.items()}
+            protected_example["answer_choices"] = answer_choices
+            protected_example.update(rendering_variables)
+            if seeds is not None:
+                protected_example[RNG_VARIABLE] = self.get_rng(seeds[i])
+
+            rendered_example = rtemplate.render(**protected_example)
+            protected_examples.append(protected_example)
+            results.append(self._split_rendered(rendered_example, escaped))
+
+        if token_budget is not None:
+            if seeds is None:
+                seeds = [None] * batch_size
+            self._fit_token_budget(rtemplate, protected_examples, seeds, escaped, results, token_budget, tokenizer)
+
+        return {
+            "inputs": [parts[0] for parts in results],
+            "targets": [parts[1] if len(parts) > 1 else "" for parts in results],
+        }
+
+    def get_truncatable_variables(self):
+        """
+        Returns the names of the example fields which can be truncated to fit a prompt in a
+        token budget: the fields rendered before the first separator of the Jinja, and read
+        neither after it, directly or through the variables set from them, nor by the answer
+        choices, so that truncating them does not change the output or the choices
+
+        :return: frozenset of strings
+        """
+        key = ("truncatable_variables", self.jinja, self.answer_choices)
+        if key not in self._cache:
+            variables = _get_prompt_only_variables(env.parse(self.jinja))
+            if variables is None:
+                # The prompt cannot be told apart from the output, so nothing is truncated
+                variables = set()
+            elif self.answer_choices is not None:
+                variables -= meta.find_undeclared_variables(env.parse(self.answer_choices))
+            self._cache[key] = frozenset(variables - {"answer_choices"})
+        return self._cache[key]
+
+    def _fit_token_budget(self, rtemplate, protected_examples, seeds, escaped, results, token_budget, tokenizer):
+        """
+        Truncates the fields of the examples whose prompt has more than token_budget tokens
+        and renders them again, until their prompt fits or after TOKEN_BUDGET_MAX_ITERATIONS
+        attempts. The longest truncatable fields, in tokens, are truncated first, to the same
+        number of tokens. If truncating the fields of an example does not make its prompt
+        shorter, e.g., since they are not rendered for this example, the example is left whole.
+        Each attempt calls the tokenizer once for the prompts and once for the fields of all
+        the examples that do not fit yet.
+
+        :param rtemplate: compiled jinja template of the prompt
+        :param protected_examples: list of the jinja variables of each rendering, updated in place
+        :param seeds: list of the seeds of the examples
+        :param escaped: whether any occurrence of the separator was escaped in the examples
+        :param results: list of the rendered parts of each example, updated in place
+        :param token_budget: maximum number of tokens of the prompts
+        :param tokenizer: callable mapping a list of strings to the list of their tokens
+        """
+        variables = sorted(self.get_truncatable_variables())
+        # Fields and rendered parts of the examples before truncation, and length of their prompt
+        originals, prompt_lengths = {}, {}
+        pending = list(range(len(results)))
+        for _ in range(TOKEN_BUDGET_MAX_ITERATIONS):
+            overflows = {}
+            for i, tokens in zip(pending, tokenizer([results[i][0] for i in pending])):
+                if i in prompt_lengths and len(tokens) >= prompt_lengths[i]:
+                    fields, results[i] = originals[i]
+                    protected_examples[i].update(fields)
+                elif len(tokens) > token_budget:
+                    prompt_lengths[i] = len(tokens)
+                    overflows[i] = len(tokens) - token_budget
+
+            # The fields are truncated unescaped, so that no escaped separator is cut
+            values = {
+                (i, key): self._unescape_pipe(protected_examples[i][key])
+                for i in overflows
+                for key in variables
+                if isinstance(protected_examples[i].get(key), str) and protected_examples[i][key]
+            }
+            if not values:
+                return
+            field_lengths = defaultdict(dict)
+            for (i, key), tokens in zip(values, tokenizer(list(values.values()))):
+                field_lengths[i][key] = len(tokens)
+
+            pending = list(field_lengths)
+            for i in pending:
+                if i not in originals:
+                    fields = {key: protected_examples[i][key] for key in field_lengths[i]}
+                    originals[i] = (fields, results[i])
+                # The number of chars kept is proportional to the number of tokens kept
+                for key, max_length in _get_token_caps(field_lengths[i], overflows[i]).items():
+                    value = values[i, key]
+                    value = value[: len(value) * max_length // field_lengths[i][key]]
+                    protected_examples[i][key] = value.replace("|||", self.pipe_protector)
+                if seeds[i] is not None:
+                    protected_examples[i][RNG_VARIABLE] = self.get_rng(seeds[i])
+                results[i] = self._split_rendered(rtemplate.render(**protected_examples[i]), escaped)
 
     pipe_protector = "3ed2dface8203c4c9dfb1a5dc58e41e0"
 
@@ -409,6 +1154,44 @@ class Template(yaml.YAMLObject):
         }
         return protected_example
 
+    @classmethod
+    def _escape_pipe_variables(cls, example, variable_keys):
+        # Same as _escape_pipe, but only for the given fields of the example, which are
+        # passed to Jinja as the given variables. Also returns whether any occurrence was
+        # replaced.
+        protected_example = {}
+        escaped = False
+        for variable, key in variable_keys.items():
+            value = example[key]
+            if isinstance(value, str) and "|||" in value:
+                value = value.replace("|||", cls.pipe_protector)
+                escaped = True
+            protected_example[variable] = value
+        return protected_example, escaped
+
+    @classmethod
+    def _escape_pipe_batch(cls, batch):
+        # Same as _escape_pipe_variables, but for a batch in columnar format. Columns
+        # without any occurrence of the separator are kept as they are.
+        protected_batch = {}
+        escaped = False
+        for key, values in batch.items():
+            if any(isinstance(value, str) and "|||" in value for value in values):
+                values = [
+                    value.replace("|||", cls.pipe_protector) if isinstance(value, str) else value for value in values
+                ]
+                escaped = True
+            protected_batch[key] = values
+        return protected_batch, escaped
+
+    @classmethod
+    def _split_rendered(cls, rendered_example, escaped):
+        # Splits a rendered example on the separator, replacing back the escaped
+        # occurrences of the separator only if there are any
+        if escaped:
+            return [cls._unescape_pipe(part).strip() for part in rendered_example.split("|||")]
+        return [part.strip() for part in rendered_example.split("|||")]
+
     @classmethod
     def _unescape_pipe(cls, string):
         # replaces back any occurrences of the separator in a string
@@ -420,6 +1203,9 @@ class Template(yaml.YAMLObject):
         """
 
         yaml_tag = "!TemplateMetadata"
+        yaml_loader = YAML_LOADERS
+
+        __slots__ = ("original_task", "choices_in_prompt", "metrics", "languages", "_extra")
 
         def __init__(
             self,
@@ -446,6 +1232,676 @@ class Template(yaml.YAMLObject):
             self.choices_in_prompt = choices_in_prompt
             self.metrics = metrics
             self.languages = languages
+            self._extra = None
+
+        def __getstate__(self):
+            return _get_slots_state(self)
+
+        def __setstate__(self, state):
+            _set_slots_state(self, state)
+            if INTERN_STRINGS:
+                # The same few metrics and languages are repeated by most templates
+                if isinstance(self.metrics, list):
+                    self.metrics = [sys.intern(m) if isinstance(m, str) else m for m in self.metrics]
+                if isinstance(self.languages, list):
+                    self.languages = [sys.intern(lang) if isinstance(lang, str) else lang for lang in self.languages]
+
+
+def _get_token_caps(lengths, overflow):
+    """
+    Returns the numbers of tokens to which fields are truncated so that overflow tokens are
+    removed, cutting the longest fields first down to the same number of tokens
+
+    :param lengths: dict of the number of tokens of each field
+    :param overflow: number of tokens to remove
+    :return: dict of the number of tokens to keep for each field to truncate
+    """
+    sorted_lengths = sorted(lengths.values(), reverse=True) + [0]
+    total = 0
+    for k in range(1, len(sorted_lengths)):
+        total += sorted_lengths[k - 1]
+        # Cutting the k longest fields down to the length of the next one
+        if total - k * sorted_lengths[k] >= overflow:
+            max_length = (total - overflow) // k
+            return {key: max_length for key, length in lengths.items() if length > max_length}
+    return {key: 0 for key in lengths}
+
+
+def precompile_templates(template_collection: Optional["TemplateCollection"] = None) -> int:
+    """
+    Compiles the prompts of all templates, as used by Template.apply, which also fills the
+    bytecode cache if enabled
+
+    :param template_collection: templates to compile, defaults to all templates
+    :return: number of compiled templates
+    """
+    if template_collection is None:
+        template_collection = TemplateCollection()
+
+    count = 0
+    for dataset_name, subset_name in template_collection.keys:
+        dataset_templates = template_collection.get_dataset(dataset_name, subset_name)
+        for template in dataset_templates.templates.values():
+            try:
+                template._get_compiled_prompt()
+                count += 1
+            except TemplateError as err:
+                logging.warning(
+                    f"Unable to compile template {template.get_name()} of {dataset_name}/{subset_name}: {err}"
+                )
+    return count
+
+
+class RenderCache:
+    """
+    Cache of prompts created by Template.apply, keyed by the template id, a hash of the
+    template source, a hash of the example fields referenced by the template and the
+    arguments of apply.
+
+    The most recently used prompts are kept in memory. If use_disk is True, prompts are also
+    stored in an SQLite database under DEFAULT_PROMPTSOURCE_CACHE_HOME, shared by processes.
+
+    Prompts of templates using a random filter, such as choice or random, are only cached
+    when seeded, and examples whose referenced fields are not JSON serializable are never
+    cached.
+    """
+
+    def __init__(self, maxsize: int = 4096, use_disk: bool = False, max_disk_size: int = 1000000, path=None):
+        """
+        :param maxsize: maximum number of prompts kept in memory
+        :param use_disk: if True, prompts are also stored on disk
+        :param max_disk_size: maximum number of prompts kept on disk
+        :param path: path of the on-disk database, defaults to renders.sqlite under
+                     DEFAULT_PROMPTSOURCE_CACHE_HOME
+        """
+        self.maxsize = maxsize
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if use_disk:
+            import sqlite3
+
+            self.path = path or os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "renders.sqlite")
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute("CREATE TABLE IF NOT EXISTS renders (key TEXT PRIMARY KEY, prompt TEXT)")
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def clear(self) -> None:
+        """
+        Drops all cached prompts, in memory and on disk, and resets the counters
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM renders")
+            self.hits = 0
+            self.misses = 0
+
+    def get_key(self, template: Template, example: Dict, **kwargs) -> Optional[str]:
+        """
+        Returns the cache key of a prompt, or None if it cannot be cached
+
+        :param template: template applied to the example
+        :param example: the dataset example
+        :param kwargs: keyword arguments of Template.apply
+        :return: hex digest, or None
+        """
+        if kwargs.get("seed") is None and not template.is_deterministic():
+            return None
+        fields = {variable: example[key] for variable, key in template.get_variable_keys(example).items()}
+        try:
+            serialized = json.dumps(
+                [template.get_id(), template.jinja, template.answer_choices, fields, kwargs],
+                sort_keys=True,
+                ensure_ascii=False,
+            )
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def apply(self, template: Template, example: Dict, **kwargs) -> List[str]:
+        """
+        Returns the cached prompt of a template for an example, creating it with
+        Template.apply on a cache miss
+
+        :param template: template to apply
+        :param example: the dataset example to create a prompt for
+        :param kwargs: keyword arguments of Template.apply
+        :return: same as Template.apply
+        """
+        key = self.get_key(template, example, **kwargs)
+        if key is None:
+            return template.apply(example, **kwargs)
+
+        prompt = self._get(key)
+        if prompt is None:
+            prompt = template.apply(example, **kwargs)
+            self._set(key, prompt)
+        return list(prompt)
+
+    def _get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            prompt = self._memory.get(key)
+            if prompt is not None:
+                self._memory.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT prompt FROM renders WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    prompt = json.loads(row[0])
+                    self._set_memory(key, prompt)
+
+            if prompt is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return prompt
+
+    def _set(self, key: str, prompt: List[str]) -> None:
+        with self._lock:
+            self._set_memory(key, prompt)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO renders (key, prompt) VALUES (?, ?)", (key, json.dumps(prompt))
+                )
+                # Evicts the oldest prompts beyond max_disk_size
+                self._db.execute(
+                    "DELETE FROM renders WHERE rowid <= (SELECT MAX(rowid) FROM renders) - ?", (self.max_disk_size,)
+                )
+
+    def _set_memory(self, key: str, prompt: List[str]) -> None:
+        self._memory[key] = prompt
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+
+def _read_templates_file(yaml_path: str, loader=None) -> Dict:
+    """
+    Reads the templates of a templates.yaml file
+
+    :param yaml_path: path of the file
+    :param loader: YAML loader class, defaults to YAML_LOADER
+    :return: dict of templates, keyed by template id
+    """
+    with open(yaml_path, "r") as yaml_file:
+        yaml_dict = yaml.load(yaml_file, Loader=loader or YAML_LOADER)
+    return yaml_dict[DatasetTemplates.TEMPLATES_KEY]
+
+
+class TemplateSummary(NamedTuple):
+    """
+    What is known of a template without loading it: its name, the metadata it is indexed by
+    and its static analysis. The metadata are copied, since the Metadata object of a template
+    can be edited in place before it is updated.
+    """
+
+    name: str
+    metrics: Tuple[str, ...]
+    languages: Tuple[str, ...]
+    original_task: Optional[bool]
+    choices_in_prompt: Optional[bool]
+    # None if the template does not parse
+    analysis: Optional[TemplateAnalysis]
+
+
+def _summarize_templates(templates: Dict) -> Dict[str, TemplateSummary]:
+    # Summaries of templates keyed by template id
+    summaries = {}
+    for template_id, template in templates.items():
+        try:
+            analysis = template.get_analysis()
+        except TemplateError:
+            analysis = None
+        metadata = template.metadata
+        summaries[template_id] = TemplateSummary(
+            template.get_name(),
+            tuple(metadata.metrics or ()),
+            tuple(metadata.languages or ()),
+            metadata.original_task,
+            metadata.choices_in_prompt,
+            analysis,
+        )
+    return summaries
+
+
+def _serialize_templates_file(yaml_path: str) -> Tuple[bytes, Dict[str, TemplateSummary]]:
+    # Reads, pickles and summarizes the templates of a file, so that workers of a process
+    # pool directly return the entries of the templates index
+    templates = _read_templates_file(yaml_path)
+    return pickle.dumps(templates, protocol=pickle.HIGHEST_PROTOCOL), _summarize_templates(templates)
+
+
+class TemplateIndex:
+    """
+    Hash indexes of the templates of a TemplateCollection: the dataset of each template id,
+    the id of each (dataset_name, subset_name, template name), and the ids of the templates
+    of each dataset, metric, language and value of original_task, choices_in_prompt and of
+    whether the answer choices are the same for every example. They are built from the
+    template summaries when they are first used, without loading the templates, and then
+    updated by DatasetTemplates.add_template, update_template and remove_template.
+    """
+
+    def __init__(self, datasets_templates: "_DatasetTemplatesMapping"):
+        """
+        :param datasets_templates: datasets whose templates are indexed
+        """
+        self._datasets_templates = datasets_templates
+        self._summaries: Optional[Dict[str, TemplateSummary]] = None
+
+    def _build(self) -> None:
+        self._summaries = {}
+        self.keys: Dict[str, Tuple[str, Optional[str]]] = {}
+        self.ids_by_name: Dict[Tuple[str, Optional[str], str], str] = {}
+        self.ids_by_key: Dict[Tuple[str, Optional[str]], Set[str]] = defaultdict(set)
+        self.ids_by_metric: Dict[str, Set[str]] = defaultdict(set)
+        self.ids_by_language: Dict[str, Set[str]] = defaultdict(set)
+        self.ids_by_original_task: Dict[Optional[bool], Set[str]] = defaultdict(set)
+        self.ids_by_choices_in_prompt: Dict[Optional[bool], Set[str]] = defaultdict(set)
+        self.ids_by_fixed_choices: Dict[bool, Set[str]] = defaultdict(set)
+        for key in self._datasets_templates:
+            for template_id, summary in self._datasets_templates.get_summaries(key).items():
+                self._add(key, template_id, summary)
+
+    def _ensure_built(self) -> None:
+        if self._summaries is None:
+            self._build()
+
+    def _get_inverted_indexes(self, summary: TemplateSummary) -> List[Tuple[Dict, object]]:
+        # Inverted indexes containing a template, along with its value in each of them
+        has_fixed_choices = summary.analysis is not None and summary.analysis.fixed_answer_choices is not None
+        return (
+            [(self.ids_by_metric, metric) for metric in summary.metrics]
+            + [(self.ids_by_language, language) for language in summary.languages]
+            + [
+                (self.ids_by_original_task, summary.original_task),
+                (self.ids_by_choices_in_prompt, summary.choices_in_prompt),
+                (self.ids_by_fixed_choices, has_fixed_choices),
+            ]
+        )
+
+    def _add(self, key: Tuple[str, Optional[str]], template_id: str, summary: TemplateSummary) -> None:
+        self._summaries[template_id] = summary
+        self.keys[template_id] = key
+        self.ids_by_name[key + (summary.name,)] = template_id
+        self.ids_by_key[key].add(template_id)
+        for index, value in self._get_inverted_indexes(summary):
+            index[value].add(template_id)
+
+    def _remove(self, template_id: str) -> None:
+        summary = self._summaries.pop(template_id, None)
+        if summary is None:
+            return
+        key = self.keys.pop(template_id)
+        if self.ids_by_name.get(key + (summary.name,)) == template_id:
+            del self.ids_by_name[key + (summary.name,)]
+        for index, value in [(self.ids_by_key, key)] + self._get_inverted_indexes(summary):
+            index[value].discard(template_id)
+            if not index[value]:
+                del index[value]
+
+    def add_templates(self, key: Tuple[str, Optional[str]], templates: Dict[str, "Template"]) -> None:
+        """
+        Indexes new or updated templates of a dataset
+
+        :param key: (dataset_name, subset_name)
+        :param templates: dict of templates, keyed by template id
+        """
+        if self._summaries is not None:
+            for template_id, summary in _summarize_templates(templates).items():
+                self._remove(template_id)
+                self._add(key, template_id, summary)
+
+    def remove_templates(self, template_ids: List[str]) -> None:
+        if self._summaries is not None:
+            for template_id in template_ids:
+                self._remove(template_id)
+
+    def remove_dataset(self, key: Tuple[str, Optional[str]]) -> None:
+        if self._summaries is not None:
+            self.remove_templates(list(self.ids_by_key.get(key, [])))
+
+    def get_key(self, template_id: str) -> Tuple[str, Optional[str]]:
+        """
+        Returns the (dataset_name, subset_name) of a template, raising a KeyError if no
+        template has this id
+        """
+        self._ensure_built()
+        return self.keys[template_id]
+
+    def get_dataset_ids(self, key: Tuple[str, Optional[str]]) -> Set[str]:
+        """
+        Returns the ids of the templates of a dataset
+
+        :param key: (dataset_name, subset_name)
+        """
+        self._ensure_built()
+        return set(self.ids_by_key.get(key, ()))
+
+    def get_id(self, dataset_name: str, subset_name: Optional[str], template_name: str) -> str:
+        """
+        Returns the id of a template from its name, raising a KeyError if there is none
+        """
+        self._ensure_built()
+        return self.ids_by_name[dataset_name, subset_name, template_name]
+
+    def get_summary(self, template_id: str) -> TemplateSummary:
+        self._ensure_built()
+        return self._summaries[template_id]
+
+    def get_ids(
+        self, metric: Optional[str] = None, language: Optional[str] = None, original_task: Optional[bool] = None
+    ) -> Set[str]:
+        """
+        Returns the ids of the templates matching all the given conditions, see select_ids
+
+        :param metric: if not None, metric the templates are evaluated with
+        :param language: if not None, language the templates use
+        :param original_task: if not None, value of the original_task of the templates
+        :return: set of template ids
+        """
+        return self.select_ids(
+            metrics=None if metric is None else [metric],
+            languages=None if language is None else [language],
+            original_task=original_task,
+        )
+
+    def select_ids(
+        self,
+        keys: Optional[List[Tuple[str, Optional[str]]]] = None,
+        metrics: Optional[List[str]] = None,
+        languages: Optional[List[str]] = None,
+        original_task: Optional[bool] = None,
+        choices_in_prompt: Optional[bool] = None,
+        has_fixed_choices: Optional[bool] = None,
+    ) -> Set[str]:
+        """
+        Returns the ids of the templates matching all the given conditions, intersecting
+        the inverted indexes from the smallest one. Conditions which are None are ignored.
+
+        :param keys: (dataset_name, subset_name) of the datasets the templates belong to
+        :param metrics: metrics, one of which the templates are evaluated with
+        :param languages: languages, one of which the templates use
+        :param original_task: value of the original_task of the templates
+        :param choices_in_prompt: value of the choices_in_prompt of the templates
+        :param has_fixed_choices: whether the answer choices of the templates are the same
+                                  for every example
+        :return: set of template ids
+        """
+        self._ensure_built()
+        sets = []
+        for index, values in [
+            (self.ids_by_key, keys),
+            (self.ids_by_metric, metrics),
+            (self.ids_by_language, languages),
+        ]:
+            if values is not None:
+                value_sets = [index[value] for value in values if value in index]
+                sets.append(value_sets[0] if len(value_sets) == 1 else set().union(*value_sets))
+        for index, value in [
+            (self.ids_by_original_task, original_task),
+            (self.ids_by_choices_in_prompt, choices_in_prompt),
+            (self.ids_by_fixed_choices, has_fixed_choices),
+        ]:
+            if value is not None:
+                sets.append(index.get(value, set()))
+        if not sets:
+            return set(self.keys)
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+
+class _DatasetTemplatesMapping(MutableMapping):
+    """
+    Dict of DatasetTemplates, keyed by (dataset_name, subset_name), which only
+    materializes a DatasetTemplates when it is first accessed
+    """
+
+    def __init__(
+        self,
+        serialized_templates: Dict[Tuple[str, Optional[str]], bytes],
+        summaries: Optional[Dict[Tuple[str, Optional[str]], Dict[str, TemplateSummary]]] = None,
+    ):
+        # Pickled dicts of templates, which are loaded on first access, along with the
+        # summaries of the templates. Analyses are set on the loaded templates.
+        self._serialized_templates = serialized_templates
+        self._summaries = summaries or {}
+        self._datasets_templates: Dict[Tuple[str, Optional[str]], DatasetTemplates] = {}
+        self.index = TemplateIndex(self)
+
+    def __getitem__(self, key):
+        if key not in self._datasets_templates:
+            templates = self._load_templates(key)
+            for template_id, summary in self._summaries.get(key, {}).items():
+                if summary.analysis is not None and template_id in templates:
+                    templates[template_id]._set_analysis(summary.analysis)
+            self._datasets_templates[key] = DatasetTemplates(*key, templates=templates)
+            self._datasets_templates[key].index = self.index
+        return self._datasets_templates[key]
+
+    def _load_templates(self, key) -> Dict:
+        return pickle.loads(self._serialized_templates[key])
+
+    def is_loaded(self, key) -> bool:
+        return key in self._datasets_templates
+
+    def get_summaries(self, key) -> Dict[str, TemplateSummary]:
+        """
+        Returns the summaries of the templates of a dataset, without loading the templates
+        if the summaries were precomputed
+
+        :return: dict of TemplateSummary keyed by template id
+        """
+        if key not in self._datasets_templates and key in self._summaries:
+            return self._summaries[key]
+        return _summarize_templates(self[key].templates)
+
+    def __setitem__(self, key, value):
+        self.index.remove_dataset(key)
+        self._serialized_templates.pop(key, None)
+        self._summaries.pop(key, None)
+        self._datasets_templates[key] = value
+        value.index = self.index
+        self.index.add_templates(key, value.templates)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.index.remove_dataset(key)
+        self._serialized_templates.pop(key, None)
+        self._summaries.pop(key, None)
+        self._datasets_templates.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._datasets_templates or key in self._serialized_templates
+
+    def __iter__(self):
+        yield from self._serialized_templates
+        for key in self._datasets_templates:
+            if key not in self._serialized_templates:
+                yield key
+
+    def __len__(self):
+        return len(self._serialized_templates.keys() | self._datasets_templates.keys())
+
+    def __repr__(self):
+        # Lists the keys only, since showing the DatasetTemplates would load all of them
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+class TemplateStore:
+    """
+    Read-only file of the templates of a collection, written once by write_template_store,
+    which processes such as dataloader workers attach to instead of loading a collection.
+    The file is memory-mapped, so that its pages are shared by all the processes, and each
+    template is only decoded when it is accessed.
+    """
+
+    MAGIC = b"PSTSTORE"
+
+    # Bumped whenever the format of the store or of the pickled templates changes
+    VERSION = 4
+
+    # Magic bytes, version and length of the header
+    PREAMBLE = struct.Struct("<8sIQ")
+
+    def __init__(self, path: str):
+        """
+        :param path: path of a file written by write_template_store
+        """
+        self.path = path
+        with open(path, "rb") as store_file:
+            self._mmap = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = self.PREAMBLE.unpack_from(self._mmap)
+        if magic != self.MAGIC or version != self.VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a template store of version {self.VERSION}.")
+        # The header only holds the positions of the records of each dataset and of the
+        # dataset of each template, which are decoded when first needed
+        header = self._read(self.PREAMBLE.size, header_length)
+        self._data_offset = self.PREAMBLE.size + header_length
+        self._datasets: Dict[Tuple[str, Optional[str]], Tuple[int, int]] = header["datasets"]
+        self._template_keys_position: Tuple[int, int] = header["template_keys"]
+        self._template_keys = None
+        self._entries = {}
+
+    def __reduce__(self):
+        # Processes receiving a store attach to the same file
+        return TemplateStore, (self.path,)
+
+    def _read(self, offset: int, length: int):
+        return pickle.loads(self._mmap[offset : offset + length])
+
+    def _get_entry(self, key: Tuple[str, Optional[str]]) -> Dict:
+        # Positions of the templates of a dataset, keyed by template id, and their summaries
+        if key not in self._entries:
+            offset, length = self._datasets[key]
+            self._entries[key] = self._read(self._data_offset + offset, length)
+        return self._entries[key]
+
+    def _get_template_keys(self) -> Dict[str, Tuple[str, Optional[str]]]:
+        if self._template_keys is None:
+            offset, length = self._template_keys_position
+            self._template_keys = self._read(self._data_offset + offset, length)
+        return self._template_keys
+
+    @property
+    def keys(self) -> List[Tuple[str, Optional[str]]]:
+        return list(self._datasets.keys())
+
+    def __contains__(self, template_id: str) -> bool:
+        return template_id in self._get_template_keys()
+
+    def __len__(self) -> int:
+        return len(self._get_template_keys())
+
+    def get_summaries(self, dataset_name: str, subset_name: Optional[str] = None) -> Dict[str, TemplateSummary]:
+        """
+        Returns the summaries of the templates of a dataset, without decoding them
+
+        :return: dict of TemplateSummary keyed by template id
+        """
+        return self._get_entry((dataset_name, subset_name))["summaries"]
+
+    def get_template(self, template_id: str) -> Template:
+        """
+        Decodes a template of the store
+
+        :param template_id: id of the template
+        :return: Template, with its analysis if it parses
+        """
+        entry = self._get_entry(self._get_template_keys()[template_id])
+        offset, length = entry["templates"][template_id]
+        template = self._read(self._data_offset + offset, length)
+        analysis = entry["summaries"][template_id].analysis
+        if analysis is not None:
+            template._set_analysis(analysis)
+        return template
+
+    def get_templates(self, dataset_name: str, subset_name: Optional[str] = None) -> Dict[str, Template]:
+        """
+        Decodes the templates of a dataset
+
+        :param dataset_name: name of the dataset
+        :param subset_name: name of the subset
+        :return: dict of templates, keyed by template id
+        """
+        templates = {}
+        entry = self._get_entry((dataset_name, subset_name))
+        for template_id, (offset, length) in entry["templates"].items():
+            templates[template_id] = self._read(self._data_offset + offset, length)
+            analysis = entry["summaries"][template_id].analysis
+            if analysis is not None:
+                templates[template_id]._set_analysis(analysis)
+        return templates
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def write_template_store(path: str, template_collection: Optional["TemplateCollection"] = None) -> int:
+    """
+    Writes the templates of a collection to a TemplateStore file, atomically so that
+    processes attaching to it never see a partial file
+
+    :param path: path of the file
+    :param template_collection: templates to write, defaults to a new TemplateCollection
+    :return: number of templates written
+    """
+    if template_collection is None:
+        template_collection = TemplateCollection()
+
+    records, datasets, template_keys = [], {}, {}
+    position = 0
+
+    def add_record(value) -> Tuple[int, int]:
+        nonlocal position
+        record = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        records.append(record)
+        position += len(record)
+        return position - len(record), len(record)
+
+    for key in template_collection.keys:
+        entry = {"templates": {}, "summaries": template_collection.datasets_templates.get_summaries(key)}
+        for template_id, template in template_collection.datasets_templates[key].templates.items():
+            entry["templates"][template_id] = add_record(template)
+            template_keys[template_id] = key
+        datasets[key] = add_record(entry)
+
+    header = pickle.dumps(
+        {"datasets": datasets, "template_keys": add_record(template_keys)}, protocol=pickle.HIGHEST_PROTOCOL
+    )
+    with atomic_write(path, "wb") as store_file:
+        store_file.write(TemplateStore.PREAMBLE.pack(TemplateStore.MAGIC, TemplateStore.VERSION, len(header)))
+        store_file.write(header)
+        store_file.writelines(records)
+    return len(template_keys)
+
+
+class _StoredDatasetTemplatesMapping(_DatasetTemplatesMapping):
+    """
+    Dict of DatasetTemplates, keyed by (dataset_name, subset_name), whose templates are
+    decoded from a TemplateStore when they are first accessed
+    """
+
+    def __init__(self, store: TemplateStore):
+        super().__init__(dict.fromkeys(store.keys))
+        self._store = store
+
+    def _load_templates(self, key) -> Dict:
+        return self._store.get_templates(*key)
+
+    def get_summaries(self, key) -> Dict[str, TemplateSummary]:
+        if key not in self._datasets_templates and key in self._serialized_templates:
+            return self._store.get_summaries(*key)
+        return super().get_summaries(key)
 
 
 class TemplateCollection:
@@ -454,11 +1910,32 @@ class TemplateCollection:
     - Initialized the DatasetTemplates for all existing template folder
     - Give access to each DatasetTemplates
     - Provides aggregated counts over all DatasetTemplates
+
+    Parsed templates are cached in an index file under DEFAULT_PROMPTSOURCE_CACHE_HOME,
+    where each templates.yaml is only parsed again when it changes, along with the static
+    analysis of each template. DatasetTemplates are materialized when they are first accessed.
     """
 
-    def __init__(self):
+    # Bumped whenever the format of the index or of the pickled templates changes
+    INDEX_VERSION = 6
+
+    # Minimum number of files to parse for parsing them with a process pool
+    MIN_FILES_FOR_POOL = 32
+
+    def __init__(self, use_cache: bool = True, store: Optional[TemplateStore] = None):
+        """
+        :param use_cache: if True, parsed templates are read from and written to the
+                          templates index file
+        :param store: if not None, templates are read from this TemplateStore instead of
+                      the templates folder, e.g., in the workers of a dataloader
+        """
+        self.use_cache = use_cache
         # Dict of all the DatasetTemplates, key is the tuple (dataset_name, subset_name)
-        self.datasets_templates: Dict[(str, Optional[str]), DatasetTemplates] = self._collect_datasets()
+        self.datasets_templates: MutableMapping[Tuple[str, Optional[str]], DatasetTemplates]
+        if store is not None:
+            self.datasets_templates = _StoredDatasetTemplatesMapping(store)
+        else:
+            self.datasets_templates = self._collect_datasets()
 
     @property
     def keys(self):
@@ -470,34 +1947,117 @@ class TemplateCollection:
     def remove(self, dataset_name: str, subset_name: Optional[str] = None) -> None:
         del self.datasets_templates[dataset_name, subset_name]
 
-    def _collect_datasets(self) -> Dict[Tuple[str, str], "DatasetTemplates"]:
+    @property
+    def index_path(self) -> str:
+        # Index files are specific to a templates folder
+        return get_keyed_path(
+            os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "templates_index.pkl"), TEMPLATES_FOLDER_PATH
+        )
+
+    def _collect_datasets(self) -> MutableMapping[Tuple[str, Optional[str]], "DatasetTemplates"]:
         """
-        Initialize a DatasetTemplates object for each templates.yaml detected in the templates folder
+        Collects the templates of each templates.yaml detected in the templates folder
 
-        Returns: a dict with key=(dataset_name, subset_name)
+        Returns: a lazy dict with key=(dataset_name, subset_name)
         """
         dataset_folders = os.listdir(TEMPLATES_FOLDER_PATH)
         dataset_folders = [folder for folder in dataset_folders if not folder.startswith(".")]
 
-        output = {}  # format is {(dataset_name, subset_name): DatasetsTemplates}
+        keys = []  # format is [(dataset_name, subset_name)]
         for dataset in dataset_folders:
             if dataset in INCLUDED_USERS:
                 for filename in os.listdir(os.path.join(TEMPLATES_FOLDER_PATH, dataset)):
-                    output = {**output, **self._collect_dataset(dataset + "/" + filename)}
+                    keys.extend(self._collect_dataset(dataset + "/" + filename))
             else:
-                output = {**output, **self._collect_dataset(dataset)}
-        return output
+                keys.extend(self._collect_dataset(dataset))
+
+        yaml_paths = {key: DatasetTemplates(*key, templates={}).yaml_path for key in keys}
+        return _DatasetTemplatesMapping(*self._load_index(yaml_paths))
 
     def _collect_dataset(self, dataset):
-        output = {}  # format is {(dataset_name, subset_name): DatasetsTemplates}
+        keys = []  # format is [(dataset_name, subset_name)]
         for filename in os.listdir(os.path.join(TEMPLATES_FOLDER_PATH, dataset)):
             if filename.endswith(".yaml"):
                 # If there is no sub-folder, there is no subset for this dataset
-                output[(dataset, None)] = DatasetTemplates(dataset)
+                keys.append((dataset, None))
             else:
                 # This is a subfolder, and its name corresponds to the subset name
-                output[(dataset, filename)] = DatasetTemplates(dataset_name=dataset, subset_name=filename)
-        return output
+                keys.append((dataset, filename))
+        return keys
+
+    def _load_index(self, yaml_paths: Dict[Tuple[str, Optional[str]], str]) -> Tuple[Dict, Dict]:
+        """
+        Loads the pickled templates and the template summaries of each file, from the index
+        file for the files which did not change since the index was written, and by parsing
+        the other files
+
+        :param yaml_paths: dict of paths of templates.yaml files, keyed by (dataset_name, subset_name)
+        :return: tuple of the dict of pickled templates and of the dict of template summaries
+                 keyed by template id, both keyed by (dataset_name, subset_name)
+        """
+        index = {}  # format is {yaml_path: (mtime_ns, size, pickled templates, summaries)}
+        if self.use_cache and os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "rb") as index_file:
+                    cached_index = pickle.load(index_file)
+                if cached_index["version"] == self.INDEX_VERSION:
+                    index = cached_index["files"]
+            except Exception as err:
+                logging.warning(f"Ignoring unreadable templates index {self.index_path}: {err}")
+
+        serialized_templates, summaries = {}, {}
+        stale_keys = []
+        for key, yaml_path in yaml_paths.items():
+            stat = os.stat(yaml_path)
+            entry = index.get(yaml_path)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                serialized_templates[key], summaries[key] = entry[2:]
+            else:
+                stale_keys.append(key)
+                index[yaml_path] = (stat.st_mtime_ns, stat.st_size, None, None)
+
+        if stale_keys:
+            stale_paths = [yaml_paths[key] for key in stale_keys]
+            for key, (serialized, file_summaries) in zip(stale_keys, self._parse_files(stale_paths)):
+                serialized_templates[key], summaries[key] = serialized, file_summaries
+                index[yaml_paths[key]] = index[yaml_paths[key]][:2] + (serialized, file_summaries)
+
+            if self.use_cache:
+                self._write_index({path: index[path] for path in yaml_paths.values()})
+
+        return serialized_templates, summaries
+
+    def _parse_files(self, yaml_paths: List[str]) -> List[Tuple[bytes, Dict]]:
+        """
+        Parses and analyzes templates.yaml files, on a process pool if there are many of them
+
+        :param yaml_paths: paths of the files
+        :return: list of tuples of pickled templates and of template summaries, in the same
+                 order as yaml_paths
+        """
+        if len(yaml_paths) >= self.MIN_FILES_FOR_POOL and (os.cpu_count() or 1) > 1:
+            # Only imported when needed, since importing multiprocessing is slow
+            from concurrent.futures import ProcessPoolExecutor
+            from concurrent.futures.process import BrokenProcessPool
+
+            try:
+                with ProcessPoolExecutor() as executor:
+                    return list(executor.map(_serialize_templates_file, yaml_paths, chunksize=8))
+            except (OSError, BrokenProcessPool) as err:
+                logging.warning(f"Parsing templates without a process pool: {err}")
+        return [_serialize_templates_file(yaml_path) for yaml_path in yaml_paths]
+
+    def _write_index(self, index: Dict) -> None:
+        """
+        Atomically writes the index file, so that concurrent readers never see a partial file
+        """
+        try:
+            with atomic_write(self.index_path, "wb") as index_file:
+                pickle.dump(
+                    {"version": self.INDEX_VERSION, "files": index}, index_file, protocol=pickle.HIGHEST_PROTOCOL
+                )
+        except OSError as err:
+            logging.warning(f"Unable to write templates index {self.index_path}: {err}")
 
     def get_dataset(self, dataset_name: str, subset_name: Optional[str] = None) -> "DatasetTemplates":
         """
@@ -507,11 +2067,140 @@ class TemplateCollection:
         :param subset_name: name of the subset
         """
         # if the dataset does not exist, we add it
-        if dataset_name not in self.keys:
+        if (dataset_name, subset_name) not in self.datasets_templates:
             self.datasets_templates[(dataset_name, subset_name)] = DatasetTemplates(dataset_name, subset_name)
 
         return self.datasets_templates[(dataset_name, subset_name)]
 
+    @property
+    def index(self) -> TemplateIndex:
+        return self.datasets_templates.index
+
+    def get_template(self, template_id: str) -> "Template":
+        """
+        Returns a template from its id, only loading the templates of its dataset
+
+        :param template_id: id of the template
+        """
+        return self.datasets_templates[self.index.get_key(template_id)].templates[template_id]
+
+    def get_template_by_name(
+        self, dataset_name: str, template_name: str, subset_name: Optional[str] = None
+    ) -> "Template":
+        """
+        Returns a template from its name, only loading the templates of its dataset
+
+        :param dataset_name: name of the dataset
+        :param template_name: name of the template
+        :param subset_name: name of the subset
+        """
+        return self.get_template(self.index.get_id(dataset_name, subset_name, template_name))
+
+    def get_templates_ids(
+        self, metric: Optional[str] = None, language: Optional[str] = None, original_task: Optional[bool] = None
+    ) -> Set[str]:
+        """
+        Returns the ids of the templates matching all the given conditions from the indexes,
+        without loading any template. For example, get_templates_ids(metric="Accuracy",
+        language="en") returns the ids of the English templates evaluated with accuracy.
+
+        :param metric: if not None, metric the templates are evaluated with
+        :param language: if not None, language the templates use
+        :param original_task: if not None, value of the original_task of the templates
+        :return: set of template ids
+        """
+        return self.index.get_ids(metric=metric, language=language, original_task=original_task)
+
+    def select(
+        self,
+        dataset_name: Optional[str] = None,
+        subset_name: Optional[str] = None,
+        languages: Optional[List[str]] = None,
+        metrics: Optional[List[str]] = None,
+        original_task: Optional[bool] = None,
+        choices_in_prompt: Optional[bool] = None,
+        has_fixed_choices: Optional[bool] = None,
+    ) -> Iterator[Tuple[str, Optional[str], "Template"]]:
+        """
+        Selects the templates matching all the given conditions from the indexes, e.g.,
+        select(languages=["en"], original_task=True, has_fixed_choices=True). Conditions which
+        are None are ignored. Templates are then loaded lazily, one dataset at a time, while
+        iterating over the results.
+
+        :param dataset_name: name of the dataset of the templates
+        :param subset_name: name of the subset of the templates, only used with dataset_name.
+                            If None, templates of all the subsets are selected.
+        :param languages: languages, one of which the templates use
+        :param metrics: metrics, one of which the templates are evaluated with
+        :param original_task: value of the original_task of the templates
+        :param choices_in_prompt: value of the choices_in_prompt of the templates
+        :param has_fixed_choices: whether the answer choices of the templates are the same
+                                  for every example, see Template.get_fixed_answer_choices_list
+        :return: iterator over tuples of dataset name, subset name and template, ordered by
+                 dataset, subset and template name
+        """
+        keys = None
+        if dataset_name is not None:
+            keys = [key for key in self.keys if key[0] == dataset_name and subset_name in (None, key[1])]
+        if isinstance(languages, str):
+            languages = [languages]
+        if isinstance(metrics, str):
+            metrics = [metrics]
+        template_ids = self.index.select_ids(
+            keys=keys,
+            metrics=metrics,
+            languages=languages,
+            original_task=original_task,
+            choices_in_prompt=choices_in_prompt,
+            has_fixed_choices=has_fixed_choices,
+        )
+
+        def sort_key(template_id):
+            dataset_name, subset_name = self.index.get_key(template_id)
+            return dataset_name, subset_name or "", self.index.get_summary(template_id).name
+
+        return self._iter_templates(sorted(template_ids, key=sort_key))
+
+    def _iter_templates(self, template_ids: List[str]) -> Iterator[Tuple[str, Optional[str], "Template"]]:
+        for template_id in template_ids:
+            dataset_name, subset_name = self.index.get_key(template_id)
+            yield dataset_name, subset_name, self.get_template(template_id)
+
+    def get_analysis_table(self, **conditions) -> List[Dict]:
+        """
+        Returns the static analyses of the templates of all datasets, as rows with the
+        columns dataset_name, subset_name, template_id, template_name and the fields of
+        TemplateAnalysis. Analyses are read from the templates index, without loading the
+        templates. Templates which do not parse are skipped.
+
+        For example, get_analysis_table(filters="choice") returns the templates using the
+        choice filter, and get_analysis_table(dataset_name="ag_news", deterministic=True)
+        the deterministic templates of ag_news.
+
+        :param conditions: values of columns that rows must match. For the columns variables
+                           and filters, the value must be in the set of the row.
+        :return: list of dicts
+        """
+        rows = []
+        for dataset_name, subset_name in self.keys:
+            summaries = self.datasets_templates.get_summaries((dataset_name, subset_name))
+            for template_id, summary in summaries.items():
+                if summary.analysis is None:
+                    continue
+                row = {
+                    "dataset_name": dataset_name,
+                    "subset_name": subset_name,
+                    "template_id": template_id,
+                    "template_name": summary.name,
+                    **summary.analysis._asdict(),
+                }
+                if all(
+                    value in row[column] if column in ("variables", "filters") else row[column] == value
+                    for column, value in conditions.items()
+                ):
+                    rows.append(row)
+        return rows
+
     def get_templates_count(self) -> Dict:
         """
         Return the overall number count over all datasets
@@ -521,9 +2210,9 @@ class TemplateCollection:
         """
 
         count_dict = defaultdict(int)
-        for k, v in self.datasets_templates.items():
+        for k in self.keys:
             # Subsets count towards dataset count
-            count_dict[k[0]] += len(v)
+            count_dict[k[0]] += len(self.index.get_dataset_ids(k))
         # converting to regular dict
         return dict(count_dict)
 
@@ -539,11 +2228,19 @@ class DatasetTemplates:
     SUBSET_KEY = "subset"
     TEMPLATE_FILENAME = "templates.yaml"
 
-    def __init__(self, dataset_name: str, subset_name: str = None):
+    def __init__(self, dataset_name: str, subset_name: str = None, templates: Optional[Dict] = None):
+        """
+        :param dataset_name: name of the dataset
+        :param subset_name: name of the subset
+        :param templates: dict of already loaded templates, keyed by template id. If None,
+                          they are read from the templates.yaml file.
+        """
         self.dataset_name: str = dataset_name
         self.subset_name: str = subset_name
-        # dictionary is keyed by template name.
-        self.templates: Dict = self.read_from_file()
+        # dictionary is keyed by template id.
+        self.templates: Dict = self.read_from_file() if templates is None else templates
+        # Index of the TemplateCollection holding these templates, if any, updated when they change
+        self.index: Optional[TemplateIndex] = None
 
         # Mapping from template name to template id
         self.name_to_id_mapping = {}
@@ -554,13 +2251,31 @@ class DatasetTemplates:
         Re-compute the name_to_id_mapping to ensure it is in sync with self.templates
         """
         self.name_to_id_mapping = {template.name: template.id for template in self.templates.values()}
+        self._template_names = None
 
     @property
     def all_template_names(self) -> List[str]:
         """
-        Sorted list of all templates names for this dataset
+        Sorted list of all templates names for this dataset, only sorted again when the
+        templates change
+        """
+        if self._template_names is None:
+            self._template_names = tuple(sorted([template.name for template in self.templates.values()]))
+        return list(self._template_names)
+
+    def get_referenced_variables(self, template_names: Optional[List[str]] = None) -> FrozenSet[str]:
+        """
+        Returns the names of the example fields referenced by templates of the dataset, i.e.,
+        the only columns of the dataset needed to apply them
+
+        :param template_names: names of the templates, defaults to all templates of the dataset
+        :return: frozenset of strings
         """
-        return sorted([template.name for template in self.templates.values()])
+        if template_names is None:
+            templates = self.templates.values()
+        else:
+            templates = [self[template_name] for template_name in template_names]
+        return frozenset().union(*[template.get_referenced_variables() for template in templates])
 
     @property
     def folder_path(self) -> str:
@@ -594,8 +2309,7 @@ class DatasetTemplates:
                 "Please ignore this warning if you are creating new prompts for this dataset."
             )
             return {}
-        yaml_dict = yaml.load(open(self.yaml_path, "r"), Loader=yaml.FullLoader)
-        return yaml_dict[self.TEMPLATES_KEY]
+        return _read_templates_file(self.yaml_path)
 
     def write_to_file(self) -> None:
         """
@@ -607,7 +2321,8 @@ class DatasetTemplates:
         # We only create the folder if a template is written
         if not os.path.exists(self.folder_path):
             os.makedirs(self.folder_path)
-        yaml.dump(self.format_for_dump(), open(self.yaml_path, "w"))
+        with open(self.yaml_path, "w") as yaml_file:
+            yaml.dump(self.format_for_dump(), yaml_file)
 
     def add_template(self, template: "Template") -> None:
         """
@@ -616,6 +2331,8 @@ class DatasetTemplates:
         :param template: template
         """
         self.templates[template.get_id()] = template
+        if self.index is not None:
+            self.index.add_templates((self.dataset_name, self.subset_name), {template.get_id(): template})
 
         self.write_to_file()
 
@@ -630,7 +2347,10 @@ class DatasetTemplates:
         if template_name not in self.all_template_names:
             raise ValueError(f"No template with name {template_name} for dataset {self.dataset_name} exists.")
 
-        del self.templates[self.name_to_id_mapping[template_name]]
+        template_id = self.name_to_id_mapping[template_name]
+        del self.templates[template_id]
+        if self.index is not None:
+            self.index.remove_templates([template_id])
 
         if len(self.templates) == 0:
             # There is no remaining template, we can remove the entire folder
@@ -664,6 +2384,9 @@ class DatasetTemplates:
         self.templates[template_id].reference = reference
         self.templates[template_id].metadata = metadata
         self.templates[template_id].answer_choices = answer_choices
+        self.templates[template_id].clear_cache()
+        if self.index is not None:
+            self.index.add_templates((self.dataset_name, self.subset_name), {template_id: self.templates[template_id]})
 
         self.write_to_file()
 
@@ -689,42 +2412,112 @@ class DatasetTemplates:
         return len(self.templates)
 
 
-def get_templates_data_frame():
+# Fields of the records of iter_template_records
+TEMPLATE_RECORD_FIELDS = (
+    "id",
+    "dataset",
+    "subset",
+    "name",
+    "reference",
+    "original_task",
+    "choices_in_prompt",
+    "metrics",
+    "languages",
+    "answer_choices",
+    "jinja",
+)
+
+
+def iter_template_records(template_collection: Optional[TemplateCollection] = None):
     """
-    Gathers all template information into a Pandas DataFrame.
+    Iterates over the information of all templates, one dataset at a time, ordered by
+    dataset and then by template name
 
-    :return: Pandas DataFrame
+    :param template_collection: templates to iterate over, defaults to a new TemplateCollection
+    :return: iterator over dicts with the keys TEMPLATE_RECORD_FIELDS
     """
-    data = {
-        "id": [],
-        "dataset": [],
-        "subset": [],
-        "name": [],
-        "reference": [],
-        "original_task": [],
-        "choices_in_prompt": [],
-        "metrics": [],
-        "languages": [],
-        "answer_choices": [],
-        "jinja": [],
-    }
-
-    template_collection = TemplateCollection()
+    if template_collection is None:
+        template_collection = TemplateCollection()
 
-    for key in template_collection.keys:
-        templates = template_collection.get_dataset(key[0], key[1])
+    for dataset_name, subset_name in template_collection.keys:
+        templates = template_collection.get_dataset(dataset_name, subset_name)
         for template_name in templates.all_template_names:
             template = templates[template_name]
-            data["id"].append(template.get_id())
-            data["dataset"].append(key[0])
-            data["subset"].append(key[1])
-            data["name"].append(template.get_name())
-            data["reference"].append(template.get_reference())
-            data["original_task"].append(template.metadata.original_task)
-            data["choices_in_prompt"].append(template.metadata.choices_in_prompt)
-            data["metrics"].append(template.metadata.metrics)
-            data["languages"].append(template.metadata.languages)
-            data["answer_choices"].append(template.get_answer_choices_expr())
-            data["jinja"].append(template.jinja)
-
-    return pd.DataFrame(data)
+            yield {
+                "id": template.get_id(),
+                "dataset": dataset_name,
+                "subset": subset_name,
+                "name": template.get_name(),
+                "reference": template.get_reference(),
+                "original_task": template.metadata.original_task,
+                "choices_in_prompt": template.metadata.choices_in_prompt,
+                "metrics": template.metadata.metrics,
+                "languages": template.metadata.languages,
+                "answer_choices": template.get_answer_choices_expr(),
+                "jinja": template.jinja,
+            }
+
+
+def get_templates_data_frame(template_collection: Optional[TemplateCollection] = None):
+    """
+    Gathers all template information into a Pandas DataFrame.
+
+    :param template_collection: templates to gather, defaults to a new TemplateCollection
+    :return: Pandas DataFrame
+    """
+    # pandas is only imported when needed, since importing it is slow
+    import pandas as pd
+
+    return pd.DataFrame.from_records(
+        list(iter_template_records(template_collection)), columns=list(TEMPLATE_RECORD_FIELDS)
+    )
+
+
+def write_templates_parquet(
+    path: str, template_collection: Optional[TemplateCollection] = None, row_group_size: int = 1000
+) -> int:
+    """
+    Writes all template information to a Parquet file, streaming the records so that only
+    one row group is in memory at a time
+
+    :param path: path of the Parquet file
+    :param template_collection: templates to write, defaults to a new TemplateCollection
+    :param row_group_size: number of templates per row group
+    :return: number of templates written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("id", pa.string()),
+            ("dataset", pa.string()),
+            ("subset", pa.string()),
+            ("name", pa.string()),
+            ("reference", pa.string()),
+            ("original_task", pa.bool_()),
+            ("choices_in_prompt", pa.bool_()),
+            ("metrics", pa.list_(pa.string())),
+            ("languages", pa.list_(pa.string())),
+            ("answer_choices", pa.string()),
+            ("jinja", pa.string()),
+        ]
+    )
+
+    def write(writer, records):
+        columns = {field: [record[field] for record in records] for field in TEMPLATE_RECORD_FIELDS}
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        records = []
+        for record in iter_template_records(template_collection):
+            records.append(record)
+            if len(records) == row_group_size:
+                write(writer, records)
+                count += len(records)
+                records = []
+        if records or not count:
+            write(writer, records)
+            count += len(records)
+    return count
@@ -1,13 +1,42 @@
 # coding=utf-8
+import json
+import logging
 import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-import datasets
-import requests
+from jinja2.utils import LRUCache
 
 from promptsource import DEFAULT_PROMPTSOURCE_CACHE_HOME
+from promptsource.cache import atomic_write, discard_file, get_keyed_path
 from promptsource.templates import INCLUDED_USERS
 
 
+# datasets and requests are imported by the functions using them, since importing them is
+# slow and processes applying templates don't need them
+if TYPE_CHECKING:
+    import requests
+
+
+# Endpoint listing the datasets of the Hub, with their metadata
+HUB_DATASETS_API_URL = os.environ.get("PROMPTSOURCE_HUB_API_URL", "https://huggingface.co/api/datasets?full=true")
+
+# Local snapshot of the datasets of the Hub, and number of seconds after which it is fetched again
+HUB_SNAPSHOT_PATH = os.path.join(DEFAULT_PROMPTSOURCE_CACHE_HOME, "hub_datasets.json")
+HUB_SNAPSHOT_TTL = 24 * 60 * 60
+
+# Bumped whenever the format of the snapshot changes
+HUB_SNAPSHOT_VERSION = 1
+
+# Maximum number of datasets whose column renamings are kept in memory
+COLUMN_RENAMINGS_CACHE_SIZE = 1024
+
+
 def removeHyphen(example):
     example_clean = {}
     for key in example.keys():
@@ -20,11 +49,40 @@ def removeHyphen(example):
     return example
 
 
+# Renamings of the hyphenated columns of datasets, keyed by dataset fingerprint
+_column_renamings = LRUCache(COLUMN_RENAMINGS_CACHE_SIZE)
+
+
+def get_column_renaming(dataset):
+    """
+    Returns the renaming of the hyphenated columns of a dataset, since Jinja variables
+    cannot contain hyphens
+
+    :return: dict mapping each hyphenated column to its name with underscores
+    """
+    fingerprint = getattr(dataset, "_fingerprint", None)
+    renaming = _column_renamings.get(fingerprint) if fingerprint is not None else None
+    if renaming is None:
+        column_names = getattr(dataset, "column_names", None) or []
+        renaming = {col: col.replace("-", "_") for col in column_names if "-" in col}
+        if fingerprint is not None:
+            _column_renamings[fingerprint] = renaming
+    return renaming
+
+
 def renameDatasetColumn(dataset):
-    col_names = dataset.column_names
-    for cols in col_names:
-        if "-" in cols:
-            dataset = dataset.rename_column(cols, cols.replace("-", "_"))
+    # Renames all the hyphenated columns at once, which creates a single new dataset
+    if getattr(dataset, "column_names", None) is None and hasattr(dataset, "map"):
+        # The columns of some streamed datasets, e.g., with older versions of datasets, are
+        # only known from their examples, which are renamed as they are read
+        return dataset.map(removeHyphen)
+    renaming = get_column_renaming(dataset)
+    if renaming and not hasattr(dataset, "rename_columns"):
+        # Older versions of datasets can only rename one column at a time
+        for column, new_column in renaming.items():
+            dataset = dataset.rename_column(column, new_column)
+    elif renaming:
+        dataset = dataset.rename_columns(renaming)
     return dataset
 
 
@@ -35,6 +93,8 @@ def renameDatasetColumn(dataset):
 
 def get_dataset_builder(path, conf=None):
     "Get a dataset builder from name and conf."
+    import datasets
+
     module_path = datasets.load.dataset_module_factory(path)
     builder_cls = datasets.load.import_main_class(module_path.module_path, dataset=True)
     if conf:
@@ -44,10 +104,60 @@ def get_dataset_builder(path, conf=None):
     return builder_instance
 
 
-def get_dataset(path, conf=None):
-    "Get a dataset from name and conf."
+def get_projected_columns(column_names, variables):
+    """
+    Returns the columns read by templates referencing variables, in the order of column_names.
+    Hyphenated columns are read by the variables with underscores instead of hyphens.
+
+    :param column_names: list of the columns of a dataset, or the keys of an example
+    :param variables: names of the variables referenced by the templates
+    :return: list of strings
+    """
+    return [column for column in column_names if column in variables or column.replace("-", "_") in variables]
+
+
+def project_dataset(dataset, variables):
+    """
+    Selects the columns read by templates referencing variables, so that the other columns,
+    e.g., images or long passages, are neither read nor decoded. Datasets whose columns are
+    unknown, such as some streamed datasets, are returned unchanged.
+
+    :param dataset: Dataset, IterableDataset or dict of them keyed by split, e.g., a DatasetDict
+    :param variables: names of the variables referenced by the templates, e.g., returned by
+                      DatasetTemplates.get_referenced_variables
+    """
+    if isinstance(dataset, dict):
+        return type(dataset)(
+            {split: project_dataset(split_dataset, variables) for split, split_dataset in dataset.items()}
+        )
+    if getattr(dataset, "column_names", None) is None:
+        return dataset
+    columns = get_projected_columns(dataset.column_names, variables)
+    if len(columns) == len(dataset.column_names):
+        return dataset
+    if not hasattr(dataset, "select_columns"):
+        # Older versions of datasets cannot select columns, but can remove the other ones
+        return dataset.remove_columns([column for column in dataset.column_names if column not in columns])
+    return dataset.select_columns(columns)
+
+
+def get_dataset(path, conf=None, streaming=False, variables=None):
+    """
+    Get a dataset from name and conf.
+
+    If streaming is True, the dataset is not downloaded and each split is an
+    IterableDataset which reads the examples on the fly.
+
+    If variables is not None, only the columns read by templates referencing these
+    variables are loaded, see project_dataset.
+    """
+    import datasets
+
+    if variables is not None:
+        return project_dataset(get_dataset(path, conf, streaming=streaming), variables)
+
     try:
-        return datasets.load_dataset(path, conf)
+        return datasets.load_dataset(path, conf, streaming=streaming)
     except datasets.builder.ManualDownloadError:
         cache_root_dir = (
             os.environ["PROMPTSOURCE_MANUAL_DATASET_DIR"]
@@ -60,6 +170,7 @@ def get_dataset(path, conf=None):
                 path,
                 conf,
                 data_dir=data_dir,
+                streaming=streaming,
             )
         except Exception as err:
             raise err
@@ -67,8 +178,114 @@ def get_dataset(path, conf=None):
         raise err
 
 
+# Marks the end of the examples read by StreamingExamples
+_END_OF_STREAM = object()
+
+
+class StreamingExamples:
+    """
+    Access by index to the examples of an IterableDataset, e.g., a split returned by
+    get_dataset with streaming=True, without downloading the dataset. A background thread
+    reads up to prefetch examples ahead of the last requested one, and the last max_buffered
+    examples read are kept in memory. Examples before them are read again from the start.
+    """
+
+    def __init__(self, dataset, max_buffered: int = 1000, prefetch: int = 100):
+        """
+        :param dataset: iterable over the examples
+        :param max_buffered: number of examples kept in memory
+        :param prefetch: number of examples read ahead
+        """
+        self.dataset = dataset
+        self.max_buffered = max_buffered
+        self.prefetch = prefetch
+        # Number of examples, known once the end of the dataset is reached
+        self.length = None
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self) -> None:
+        self._buffer = deque()
+        self._offset = 0  # index of the first example of the buffer
+        self._ended = False
+        self._queue = queue.Queue(maxsize=self.prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, args=(self._queue, self._stop), daemon=True)
+        self._thread.start()
+
+    def _read(self, examples_queue: queue.Queue, stop: threading.Event) -> None:
+        # Reads examples into the queue, until the end of the dataset or until stopped. The
+        # thread blocks while the queue is full, and close empties the queue to wake it up.
+        end, iterator = _END_OF_STREAM, None
+        try:
+            iterator = iter(self.dataset)
+            for example in iterator:
+                examples_queue.put(example)
+                if stop.is_set():
+                    return
+        except BaseException as err:
+            # Raised by get instead, including errors which are not exceptions
+            end = err
+        finally:
+            # Releases the stream, e.g., its connection, and always ends the examples of the
+            # queue, so that get does not wait for examples that will never be read
+            if hasattr(iterator, "close"):
+                iterator.close()
+            if not stop.is_set():
+                examples_queue.put(end)
+
+    def close(self) -> None:
+        """
+        Stops reading examples ahead. The buffered examples can still be accessed, and the
+        following ones are read again from the start.
+        """
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def get(self, start: int, stop: int) -> List[Dict]:
+        """
+        Returns the examples from index start to index stop (excluded)
+
+        :return: list of examples, shorter than stop - start if the dataset ends before stop
+        """
+        with self._lock:
+            is_closed = self._stop.is_set() and not self._ended
+            if start < self._offset or (is_closed and stop > self._offset + len(self._buffer)):
+                self.close()
+                self._start()
+
+            max_buffered = max(self.max_buffered, stop - start)
+            while not self._ended and self._offset + len(self._buffer) < stop:
+                item = self._queue.get()
+                if item is _END_OF_STREAM:
+                    self._ended = True
+                    self.length = self._offset + len(self._buffer)
+                elif isinstance(item, BaseException):
+                    self._ended = True
+                    raise item
+                else:
+                    self._buffer.append(item)
+                    if len(self._buffer) > max_buffered:
+                        self._buffer.popleft()
+                        self._offset += 1
+
+            return list(islice(self._buffer, max(start - self._offset, 0), max(stop - self._offset, 0)))
+
+    def __getitem__(self, index: int) -> Dict:
+        examples = self.get(index, index + 1)
+        if not examples:
+            raise IndexError(f"Index {index} is out of range, the dataset has {self.length} examples.")
+        return examples[0]
+
+
 def get_dataset_confs(path):
     "Get the list of confs for a dataset."
+    import datasets
+
     module_path = datasets.load.dataset_module_factory(path).module_path
     # Get dataset builder class from the processing script
     builder_cls = datasets.load.import_main_class(module_path, dataset=True)
@@ -81,6 +298,8 @@ def get_dataset_confs(path):
 
 def render_features(features):
     """Recursively render the dataset schema (i.e. the fields)."""
+    import datasets
+
     if isinstance(features, dict):
         return {k: render_features(v) for k, v in features.items()}
     if isinstance(features, datasets.features.ClassLabel):
@@ -99,24 +318,186 @@ def render_features(features):
 #
 
 
-def filter_english_datasets():
+def is_offline() -> bool:
+    """Whether the Hub must not be queried, i.e., PROMPTSOURCE_OFFLINE or HF_DATASETS_OFFLINE is 1"""
+    return os.environ.get("PROMPTSOURCE_OFFLINE", "0") == "1" or os.environ.get("HF_DATASETS_OFFLINE", "0") == "1"
+
+
+_hub_session = None
+
+
+def get_hub_session() -> "requests.Session":
+    """
+    Returns the session shared by the requests to the Hub, which keeps connections alive
+    and retries failed requests with an exponential backoff
+    """
+    global _hub_session
+    if _hub_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(max_retries=retry))
+        session.mount("http://", HTTPAdapter(max_retries=retry))
+        _hub_session = session
+    return _hub_session
+
+
+def _read_hub_snapshot(snapshot_path: str, api_url: str) -> Optional[dict]:
+    try:
+        with open(snapshot_path, "r", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if snapshot["version"] == HUB_SNAPSHOT_VERSION and snapshot["url"] == api_url:
+            return snapshot
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        logging.warning(f"Ignoring unreadable snapshot of the Hub datasets {snapshot_path}: {err}")
+    return None
+
+
+def _get_page_datasets(page: List[dict]) -> List[Tuple[str, Optional[List[str]]]]:
+    # Only keeps what filter_english_datasets needs from the metadata of each dataset
+    return [[dataset["id"], (dataset.get("cardData") or {}).get("language")] for dataset in page]
+
+
+def _fetch_hub_pages(api_url: str, partial_path: str, session: "requests.Session", ttl: float) -> List:
+    """
+    Fetches all the pages of the Hub datasets endpoint. The endpoint uses cursor-based
+    pagination, so the request of each page is sent as soon as the link to it is received,
+    while the previous page is being decoded. Fetched pages are appended to partial_path,
+    after a first line holding the time the fetch started, so that an interrupted fetch
+    resumes from the last fetched page unless it started more than ttl seconds ago.
+
+    :return: list of the ids and languages of all the datasets
+    """
+    datasets_metadata, url = [], api_url
+    if os.path.exists(partial_path):
+        with open(partial_path, "r", encoding="utf-8") as partial_file:
+            pages = []
+            for line in partial_file:
+                try:
+                    pages.append(json.loads(line))
+                except ValueError:
+                    # The last line was not fully written
+                    break
+        if pages and time.time() - pages[0].get("timestamp", 0) < ttl:
+            for page in pages[1:]:
+                datasets_metadata.extend(page["datasets"])
+                url = page["next"]
+            if url is None:
+                return datasets_metadata
+        else:
+            discard_file(partial_path)
+
+    def get(url):
+        response = session.get(url, timeout=60)
+        response.raise_for_status()
+        return response
+
+    try:
+        os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+        is_new = not os.path.exists(partial_path)
+        partial_file = open(partial_path, "a", encoding="utf-8")
+        if is_new:
+            partial_file.write(json.dumps({"timestamp": time.time()}) + "\n")
+    except OSError as err:
+        logging.warning(f"Fetching the Hub datasets without saving the fetched pages: {err}")
+        partial_file = None
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(get, url)
+            while pending is not None:
+                response = pending.result()
+                # Handle pagination of `/api/datasets` endpoint
+                next_url = response.links["next"]["url"] if "next" in response.links else None
+                pending = executor.submit(get, next_url) if next_url is not None else None
+
+                page = _get_page_datasets(response.json())
+                if partial_file is not None:
+                    partial_file.write(json.dumps({"next": next_url, "datasets": page}) + "\n")
+                    partial_file.flush()
+                datasets_metadata.extend(page)
+    finally:
+        if partial_file is not None:
+            partial_file.close()
+    return datasets_metadata
+
+
+def fetch_hub_datasets(
+    api_url: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
+    ttl: Optional[float] = None,
+    offline: Optional[bool] = None,
+) -> List[Tuple[str, Optional[List[str]]]]:
+    """
+    Returns the ids and languages of the datasets of the Hub, from the local snapshot if it is
+    more recent than ttl seconds, and from the Hub otherwise, in which case the snapshot is
+    written again if its folder is writable. If fetching fails, an outdated snapshot is used
+    instead.
+
+    :param api_url: endpoint listing the datasets, defaults to HUB_DATASETS_API_URL
+    :param snapshot_path: path of the snapshot, defaults to HUB_SNAPSHOT_PATH
+    :param ttl: maximum age of the snapshot, and of an interrupted fetch to resume, in seconds,
+                defaults to HUB_SNAPSHOT_TTL
+    :param offline: if True, only the snapshot is used, whatever its age. Defaults to is_offline().
+    :return: list of the id and of the language tags (None if unknown) of each dataset
+    """
+    api_url = api_url or HUB_DATASETS_API_URL
+    snapshot_path = snapshot_path or HUB_SNAPSHOT_PATH
+    ttl = HUB_SNAPSHOT_TTL if ttl is None else ttl
+    offline = is_offline() if offline is None else offline
+
+    snapshot = _read_hub_snapshot(snapshot_path, api_url)
+    if offline:
+        if snapshot is None:
+            raise FileNotFoundError(f"No snapshot of the Hub datasets at {snapshot_path} to use offline.")
+        return snapshot["datasets"]
+    if snapshot is not None and time.time() - snapshot["timestamp"] < ttl:
+        return snapshot["datasets"]
+
+    import requests
+
+    partial_path = get_keyed_path(f"{os.path.splitext(snapshot_path)[0]}.partial", api_url)
+    try:
+        datasets_metadata = _fetch_hub_pages(api_url, partial_path, get_hub_session(), ttl)
+    except (requests.RequestException, ValueError) as err:
+        if isinstance(err, (requests.HTTPError, ValueError)):
+            # The Hub rejected or garbled a page, e.g., an expired cursor, so the next fetch starts over
+            discard_file(partial_path)
+        if snapshot is None:
+            raise
+        logging.warning(f"Using the outdated snapshot of the Hub datasets, fetching failed: {err}")
+        return snapshot["datasets"]
+
+    snapshot = {
+        "version": HUB_SNAPSHOT_VERSION,
+        "url": api_url,
+        "timestamp": time.time(),
+        "datasets": datasets_metadata,
+    }
+    try:
+        with atomic_write(snapshot_path) as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+    except OSError as err:
+        logging.warning(f"Unable to write the snapshot of the Hub datasets to {snapshot_path}: {err}")
+    discard_file(partial_path)
+    return datasets_metadata
+
+
+def filter_english_datasets(offline=None):
     """
     Filter English datasets based on language tags in metadata.
 
     Also includes the datasets of any users listed in INCLUDED_USERS
+
+    :param offline: if True, only the local snapshot of the Hub is used, see fetch_hub_datasets
     """
     english_datasets = []
 
-    response = requests.get("https://huggingface.co/api/datasets?full=true")
-    tags = response.json()
-    while "next" in response.links:
-        # Handle pagination of `/api/datasets` endpoint
-        response = requests.get(response.links["next"]["url"])
-        tags += response.json()
-
-    for dataset in tags:
-        dataset_name = dataset["id"]
-
+    for dataset_name, languages in fetch_hub_datasets(offline=offline):
         is_community_dataset = "/" in dataset_name
         if is_community_dataset:
             user = dataset_name.split("/")[0]
@@ -124,13 +505,8 @@ def filter_english_datasets():
                 english_datasets.append(dataset_name)
             continue
 
-        if "cardData" not in dataset:
-            continue
-        metadata = dataset["cardData"]
-
-        if "language" not in metadata:
+        if languages is None:
             continue
-        languages = metadata["language"]
 
         if "en" in languages or "en-US" in languages:
             english_datasets.append(dataset_name)
@@ -45,6 +45,9 @@ setup(
     ],
     description='An Integrated Development Environment and Repository for Natural Language Prompts.',
     packages=find_packages(),
+    entry_points={
+        "console_scripts": ["promptsource=promptsource.cli:main"],
+    },
     license="Apache Software License 2.0",
     long_description=readme,
     long_description_content_type="text/markdown",
@@ -0,0 +1,10 @@
+import pytest
+
+import promptsource.templates
+
+
+@pytest.fixture(autouse=True)
+def disable_bytecode_cache(monkeypatch):
+    # Tests do not write the code of their templates to the cache of the user, the tests of
+    # the bytecode cache enable it in a temporary folder
+    monkeypatch.setattr(promptsource.templates.env, "bytecode_cache", None)
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from promptsource.cache import atomic_write, get_keyed_path
+
+
+def test_get_keyed_path():
+    path = get_keyed_path("/cache/templates_index.pkl", "/templates")
+    assert path.startswith("/cache/templates_index_") and path.endswith(".pkl")
+    assert get_keyed_path("/cache/templates_index.pkl", "/templates") == path
+    assert get_keyed_path("/cache/templates_index.pkl", "/other_templates") != path
+
+
+def test_atomic_write(tmp_path):
+    path = str(tmp_path / "folder" / "file.json")
+    with atomic_write(path) as output_file:
+        output_file.write("first")
+        assert not os.path.exists(path)
+    with open(path, "r", encoding="utf-8") as input_file:
+        assert input_file.read() == "first"
+
+    # A failed write leaves the file as it was, without temporary files
+    with pytest.raises(ValueError):
+        with atomic_write(path, "wb") as output_file:
+            output_file.write(b"second")
+            raise ValueError
+    with open(path, "r", encoding="utf-8") as input_file:
+        assert input_file.read() == "first"
+    assert os.listdir(tmp_path / "folder") == ["file.json"]
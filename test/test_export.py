@@ -0,0 +1,61 @@
+import json
+
+import pyarrow.parquet as pq
+import pytest
+
+import promptsource.export
+from promptsource.cli import main
+from promptsource.templates import DatasetTemplates
+
+
+examples = [{"text": f"News number {i}", "label": i % 4} for i in range(25)]
+
+
+@pytest.fixture(autouse=True)
+def dataset(monkeypatch):
+    def get_dataset(path, conf=None, streaming=False):
+        assert (path, conf, streaming) == ("ag_news", None, True)
+        return {"train": iter(examples), "test": iter(examples[:3])}
+
+    monkeypatch.setattr(promptsource.export, "get_dataset", get_dataset)
+
+
+def read_jsonl(paths):
+    records = []
+    for path in paths:
+        with open(path) as jsonl_file:
+            records.extend(json.loads(line) for line in jsonl_file)
+    return records
+
+
+@pytest.mark.parametrize("num_proc", [1, 2])
+def test_export_jsonl(tmp_path, num_proc):
+    template = DatasetTemplates("ag_news").all_template_names[0]
+    shard_paths = promptsource.export.export_prompted_dataset(
+        "ag_news", template_names=[template], output_dir=str(tmp_path), shard_size=10, chunk_size=4, num_proc=num_proc
+    )
+    assert [len(paths) for paths in shard_paths.values()] == [3, 1]
+
+    records = read_jsonl(shard_paths["train"])
+    assert [record["idx"] for record in records] == list(range(25))
+    expected = DatasetTemplates("ag_news")[template].apply(examples[7])
+    assert [records[7]["inputs"], records[7]["targets"]] == expected
+    assert records[7]["split"] == "train"
+
+
+def test_export_cli_parquet(tmp_path):
+    main(["export", "ag_news", "--split", "train", "--output-dir", str(tmp_path), "--format", "parquet"])
+
+    table = pq.read_table(str(tmp_path / "train" / "train-00000.parquet"))
+    assert table.num_rows == len(examples) * len(DatasetTemplates("ag_news"))
+    assert not (tmp_path / "test").exists()
+
+
+def test_shard_writers_implement_the_shard_methods(tmp_path):
+    with pytest.raises(TypeError):
+        promptsource.export.ShardWriter(str(tmp_path), "train", 10)
+
+    writer = promptsource.export.JsonlShardWriter(str(tmp_path), "train", 2)
+    writer.write([{"inputs": str(i)} for i in range(3)])
+    writer.close()
+    assert [path.rsplit("/", 1)[1] for path in writer.paths] == ["train-00000.jsonl", "train-00001.jsonl"]
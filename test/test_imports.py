@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+# Modules which are slow to import, and which applying templates does not need
+SLOW_MODULES = {"datasets", "multiprocessing", "pandas", "pkg_resources", "pyarrow", "requests", "sqlite3"}
+
+
+def get_import_times(module):
+    """
+    Imports a module in a new interpreter with `python -X importtime`
+
+    :return: dict of the cumulative import time in microseconds of each imported module
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        env=env,
+        universal_newlines=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+@pytest.mark.parametrize("module", ["promptsource.templates", "promptsource.utils"])
+def test_slow_modules_are_imported_lazily(module):
+    import_times = get_import_times(module)
+    assert module in import_times
+    assert sorted(SLOW_MODULES & set(import_times)) == []
@@ -0,0 +1,93 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import promptsource.overview
+import promptsource.templates
+from promptsource.overview import OverviewRefresher, get_overview, refresh_overview
+from promptsource.templates import DatasetTemplates, Template, TemplateCollection
+
+
+@pytest.fixture
+def loaded_infos(tmp_path, monkeypatch):
+    """
+    Sets up a templates folder with a dataset and a dataset with a subset, and replaces
+    the loading of dataset infos. Returns the list of datasets whose infos were loaded.
+    """
+    monkeypatch.setattr(promptsource.templates, "TEMPLATES_FOLDER_PATH", str(tmp_path / "templates"))
+    monkeypatch.setattr(promptsource.templates, "DEFAULT_PROMPTSOURCE_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(promptsource.overview, "DEFAULT_PROMPTSOURCE_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(promptsource.overview, "DATASET_INFOS_CACHE_DIR", str(tmp_path / "cache" / "infos"))
+    os.makedirs(tmp_path / "templates")
+
+    for dataset_name, subset_name in [("dummy", None), ("other", "subset")]:
+        dataset_templates = DatasetTemplates(dataset_name, subset_name)
+        dataset_templates.add_template(Template("first", "{{ text }} ||| {{ label }}", ""))
+
+    loaded = []
+
+    def load_dataset_infos(dataset_name):
+        loaded.append(dataset_name)
+        if dataset_name == "other":
+            raise ConnectionError("offline")
+        splits = {"train": SimpleNamespace(num_examples=10), "test": SimpleNamespace(num_examples=2)}
+        return {"default": SimpleNamespace(splits=splits)}
+
+    monkeypatch.setattr(promptsource.overview, "load_dataset_infos", load_dataset_infos)
+    return loaded
+
+
+def test_overview_is_refreshed_incrementally(loaded_infos):
+    rows, stale_datasets = get_overview(TemplateCollection())
+    assert rows == [] and sorted(stale_datasets) == ["dummy", "other"]
+
+    # Datasets whose infos cannot be loaded are not written to the index
+    assert refresh_overview(stale_datasets) == ["other"]
+    rows, stale_datasets = get_overview(TemplateCollection())
+    assert stale_datasets == ["other"]
+    assert [(row["Dataset name"], row["Train size"], row["Number of prompts"]) for row in rows] == [("dummy", 10, 1)]
+
+    # Only the datasets whose templates changed are refreshed
+    time.sleep(0.01)
+    DatasetTemplates("dummy").add_template(Template("second", "{{ label }} ||| {{ text }}", ""))
+    _, stale_datasets = get_overview(TemplateCollection())
+    assert sorted(stale_datasets) == ["dummy", "other"]
+
+    loaded_infos.clear()
+    refresher = OverviewRefresher()
+    refresher.failed["other"] = (time.monotonic() + 60, 60)
+    refresher.refresh(stale_datasets)
+    refresher.join()
+    assert loaded_infos == ["dummy"]
+    rows, stale_datasets = get_overview(TemplateCollection())
+    assert stale_datasets == ["other"]
+    assert sorted(rows[0]["Prompt names"]) == ["first", "second"]
+
+    # Templates files removed since the collection was loaded change the fingerprints
+    template_collection = TemplateCollection()
+    os.remove(DatasetTemplates("dummy").yaml_path)
+    _, stale_datasets = get_overview(template_collection)
+    assert sorted(stale_datasets) == ["dummy", "other"]
+
+
+def test_failed_datasets_are_retried(loaded_infos):
+    refresher = OverviewRefresher(retry_delay=0, max_retry_delay=60)
+    for _ in range(3):
+        refresher.refresh(["other"])
+        refresher.join()
+    assert loaded_infos == ["other", "other", "other"]
+    assert refresher.failed["other"][1] == 0
+
+    # The delay before retrying doubles after each failure
+    refresher = OverviewRefresher(retry_delay=30, max_retry_delay=45)
+    refresher.refresh(["other"])
+    refresher.join()
+    refresher.refresh(["other"])
+    assert refresher.failed["other"][1] == 30
+    refresher.failed["other"] = (0, 30)
+    refresher.refresh(["other"])
+    refresher.join()
+    assert refresher.failed["other"][1] == 45
+    assert loaded_infos[3:] == ["other", "other"]
@@ -0,0 +1,34 @@
+import pytest
+
+import promptsource.schemas
+from promptsource.schemas import SchemaSnapshot
+
+
+def test_schema_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTSOURCE_SCHEMA_SNAPSHOT", str(tmp_path / "schemas.json"))
+    loaded = []
+
+    def load_features(dataset_name, subset_name=None):
+        loaded.append((dataset_name, subset_name))
+        if dataset_name == "offline":
+            raise ConnectionError("offline")
+        if dataset_name == "no_features":
+            return None
+        return {"first-sentence": {"dtype": "string", "_type": "Value"}, "label": {"names": ["a"], "_type": "ClassLabel"}}
+
+    monkeypatch.setattr(promptsource.schemas, "load_features", load_features)
+
+    snapshot = SchemaSnapshot()
+    keys = [("dummy", None), ("dummy", "subset"), ("no_features", None), ("offline", None)]
+    assert snapshot.update(keys) == [("offline", None)]
+    snapshot.save()
+
+    # Schemas are read from the snapshot without loading them again
+    loaded.clear()
+    snapshot = SchemaSnapshot()
+    assert snapshot.update(keys[:3]) == []
+    assert loaded == []
+    assert snapshot.get_columns("dummy", "subset") == {"first-sentence", "label"}
+    assert snapshot.get_columns("no_features") is None
+    with pytest.raises(KeyError):
+        snapshot.get_columns("offline")
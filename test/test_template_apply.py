@@ -0,0 +1,371 @@
+import os
+import random
+
+import pytest
+import yaml
+
+import promptsource.templates
+from promptsource.templates import DatasetTemplates, RenderCache, Template
+
+
+def test_apply_reuses_compiled_template():
+    template = Template("test", "{{ text }} ||| {{ answer_choices[label] }}", "", answer_choices="no ||| yes")
+
+    assert template.apply({"text": "a", "label": 1}) == ["a", "yes"]
+    compiled = dict(template._cache)
+    assert template.apply({"text": "b", "label": 0}) == ["b", "no"]
+    assert template._cache == compiled
+
+    # Compiled templates are shared across templates with the same source
+    other = Template("other", template.jinja, "", answer_choices=template.answer_choices)
+    other.apply({"text": "c", "label": 0})
+    assert other._cache == compiled
+
+
+def test_update_template_invalidates_compiled_template(tmp_path, monkeypatch):
+    monkeypatch.setattr(promptsource.templates, "TEMPLATES_FOLDER_PATH", str(tmp_path))
+    dataset_templates = DatasetTemplates("dummy")
+    template = Template("test", "{{ text }} ||| {{ answer_choices[label] }}", "", answer_choices="no ||| yes")
+    dataset_templates.add_template(template)
+    assert template.apply({"text": "a", "label": 1}) == ["a", "yes"]
+
+    dataset_templates.update_template(
+        "test", "test", "{{ text }}! ||| {{ answer_choices[label] }}", "", template.metadata, "false ||| true"
+    )
+    assert template.apply({"text": "a", "label": 1}) == ["a!", "true"]
+
+
+def test_compiled_templates_are_not_dumped():
+    template = Template("test", "{{ text }} ||| {{ label }}", "")
+    template.apply({"text": "a", "label": 1})
+
+    dumped = yaml.dump(template)
+    assert "_cache" not in dumped
+
+    loaded = yaml.load(dumped, Loader=yaml.FullLoader)
+    assert loaded.apply({"text": "a", "label": 1}) == ["a", "1"]
+
+
+def test_apply_batch_matches_apply():
+    template = Template(
+        "test", "{{ premise }} {{ hypothesis }}? ||| {{ answer_choices[label] }}", "", answer_choices="no ||| yes"
+    )
+    batch = {
+        "premise": ["A ||| B", "C", "D"],
+        "hypothesis": ["E", "F", "G ||| H"],
+        "label": [0, 1, 0],
+    }
+    examples = [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
+
+    outputs = template.apply_batch(batch)
+    assert outputs == {
+        "inputs": [template.apply(example)[0] for example in examples],
+        "targets": [template.apply(example)[1] for example in examples],
+    }
+    assert outputs["inputs"][0] == "A ||| B E?"
+
+
+def test_apply_batch_renders_answer_choices_per_example():
+    template = Template(
+        "test", "{{ question }} ||| {{ answer_choices[label] }}", "", answer_choices="{{ a }} ||| {{ b }}"
+    )
+    batch = {"question": ["q1", "q2"], "a": ["x", "y"], "b": ["z", "w"], "label": [0, 1]}
+
+    assert template.apply_batch(batch) == {"inputs": ["q1", "q2"], "targets": ["x", "w"]}
+
+
+def test_apply_renders_answer_choices_in_single_pass():
+    template = Template(
+        "test", "{{ question }} ||| {{ answer_choices[label] }}", "", answer_choices="{{ a }} ||| {{ b }}"
+    )
+    example = {"question": "q", "a": "x |||", "b": "y", "label": 0}
+
+    assert template.apply(example) == ["q", "x |||"]
+    assert template.get_answer_choices_list(example) == ["x |||", "y"]
+
+
+def test_fixed_answer_choices_are_precomputed():
+    template = Template("test", "{{ text }} ||| {{ answer_choices[label] }}", "", answer_choices="no ||| yes")
+    template.apply({"text": "a", "label": 0})
+    assert template._cache[("fixed_answer_choices", "no ||| yes")] == ["no", "yes"]
+
+    random_choices = '{{ ["no ||| yes", "yes ||| no"] | choice }}'
+    template = Template("test", "{{ text }} ||| {{ answer_choices[label] }}", "", answer_choices=random_choices)
+    assert template.apply({"text": "a", "label": 0})[1] in ["no", "yes"]
+    assert template._cache[("fixed_answer_choices", random_choices)] is None
+
+
+def test_truncation_uses_same_compiled_template():
+    template = Template("test", '{{ text }} {{ "}}" }} ||| {{ answer_choices[label] }}', "", answer_choices="no ||| yes")
+    example = {"text": "a" * 20, "label": 1}
+
+    assert template.apply(example, truncate=False) == ["a" * 20 + " }}", "yes"]
+    compiled = dict(template._cache)
+    assert template.apply(example, text_var_length=10) == ["a" * 7 + "... }}", "yes"]
+    assert template.apply(example) == ["a" * 20 + " }}", "yes"]
+    assert template.apply_batch({"text": [example["text"]], "label": [1]}, text_var_length=10)["inputs"] == [
+        "a" * 7 + "... }}"
+    ]
+    assert template._cache == compiled
+
+
+def test_highlight_binds_like_a_filter():
+    # Only the last operand of an expression is highlighted, as if the filter were written
+    # at its end, unless the expression is in parentheses
+    template = Template(
+        "test",
+        "{{ goal }} {{ sol[0].lower() + sol[1:] }} {{ (n * 2) }} ||| {{ answer_choices[0] if n < 12 else answer_choices[1] }}",
+        "",
+        answer_choices="A.M. ||| P.M.",
+    )
+    example = {"goal": "g", "sol": ["A", "b"], "n": 3}
+
+    def span(text):
+        return f"<span style='color: #F08080'>{text}</span>"
+
+    assert template.apply(example, highlight_variables=True) == [
+        f"{span('g')} a{span(['b'])} {span(6)}",
+        "A.M.",
+    ]
+    assert template.apply(dict(example, n=13), highlight_variables=True)[1] == span("P.M.")
+
+
+def test_token_budget_truncates_longest_fields_first():
+    calls = []
+
+    def tokenizer(texts):
+        calls.append(len(texts))
+        return [text.split() for text in texts]
+
+    template = Template("test", "Title: {{ title }} Text: {{ text }} ||| {{ title }} {{ label }}", "")
+    short = {"title": "a b", "text": "c d", "label": 0}
+    long = {"title": " ".join(["t"] * 5), "text": " ".join(["w"] * 30), "label": 1}
+
+    assert template.apply(short, token_budget=10, tokenizer=tokenizer) == template.apply(short)
+    inputs, target = template.apply(long, token_budget=20, tokenizer=tokenizer)
+    assert inputs == "Title: " + long["title"] + " Text: " + " ".join(["w"] * 13)
+    assert target == long["title"] + " 1"
+
+    # The tokenizer is called for all the examples of a batch at once
+    calls.clear()
+    batch = {key: [short[key], long[key], long[key]] for key in short}
+    outputs = template.apply_batch(batch, token_budget=20, tokenizer=tokenizer)
+    assert outputs["inputs"] == [template.apply(short)[0], inputs, inputs]
+    assert calls[:3] == [3, 2, 2]
+
+
+def test_token_budget_with_separator_in_block():
+    def tokenizer(texts):
+        return [text.split() for text in texts]
+
+    template = Template("test", "{% if text %}Text: {{ text }} ||| {{ code }}{% endif %}", "")
+    assert template.get_truncatable_variables() == {"text"}
+    example = {"text": " ".join(["w"] * 30), "code": " ".join(["c"] * 30)}
+    inputs, target = template.apply(example, token_budget=10, tokenizer=tokenizer)
+    assert len(inputs.split()) <= 10 and target == example["code"]
+
+    # Nothing is truncated when the separator is not in the text of the template
+    template = Template("test", "{{ text }}{{ '|||' }}{{ code }}", "")
+    assert template.get_truncatable_variables() == set()
+
+
+@pytest.mark.parametrize(
+    "dataset_name,subset_name,template_name,example,truncatable_variables,fits",
+    [
+        (
+            "multi_news",
+            None,
+            "expand (reverse task)",
+            {"document": "|||||".join([" ".join(["d"] * 200)] * 2), "summary": "- " + " ".join(["s"] * 200)},
+            {"summary"},
+            True,
+        ),
+        (
+            "wiki_hop",
+            "original",
+            "generate_subject",
+            {"question": "country_of_citizenship " + " ".join(["q"] * 50), "answer": "a", "supports": ["p " * 100]},
+            {"answer", "supports"},
+            False,
+        ),
+        (
+            "craigslist_bargains",
+            None,
+            "generate line",
+            {"utterance": [" ".join(["u"] * 100), "", " ".join(["v"] * 100)]},
+            set(),
+            False,
+        ),
+    ],
+)
+def test_token_budget_keeps_targets_of_shipped_templates(
+    dataset_name, subset_name, template_name, example, truncatable_variables, fits
+):
+    # These templates compute their target from fields set in variables before the separator
+    template = DatasetTemplates(dataset_name, subset_name)[template_name]
+    assert template.get_truncatable_variables() == truncatable_variables
+
+    def tokenizer(texts):
+        return [text.split() for text in texts]
+
+    _, target = template.apply(example, seed=0)
+    inputs, budget_target = template.apply(example, seed=0, token_budget=50, tokenizer=tokenizer)
+    assert budget_target == target
+    assert (len(inputs.split()) <= 50) == fits
+
+
+def test_token_budget_cuts_unescaped_fields():
+    def tokenizer(texts):
+        return [list(text) for text in texts]
+
+    # Cutting the escaped field would leave a part of the escaped separator in the prompt
+    template = Template("test", "{{ text }} ||| {{ label }}", "")
+    example = {"text": "ab|||" + "c" * 20, "label": 0}
+    inputs, target = template.apply(example, token_budget=4, tokenizer=tokenizer)
+    assert inputs == "ab||" and target == "0"
+    assert Template.pipe_protector[:4] not in template.apply(example, token_budget=10, tokenizer=tokenizer)[0]
+
+    # Fields which are not rendered for an example are not truncated
+    template = Template("test", "{% if show %}{{ text }}{% endif %}Question: {{ question }} ||| {{ label }}", "")
+    example = {"show": False, "text": "t" * 100, "question": "q" * 20, "label": 0}
+    assert template.get_truncatable_variables() == {"text", "question"}
+    assert template.apply(example, token_budget=10, tokenizer=tokenizer) == template.apply(example)
+
+
+def test_template_analysis():
+    template = Template("test", "{{ text | lower }} ||| {{ answer_choices[label] }}", "", answer_choices="{{a}} ||| {{b}}")
+    analysis = template.get_analysis()
+    assert analysis.variables == {"text", "label", "a", "b"}
+    assert analysis.filters == {"lower"}
+    assert analysis.deterministic
+    assert analysis.fixed_answer_choices is None and analysis.num_answer_choices == 2
+
+    template = Template("test", "{{ text }} ||| {{ label }}", "", answer_choices="{{ choices | join(' ||| ') }}")
+    assert template.get_analysis().num_answer_choices is None
+    template = Template("test", "{{ text }} ||| {{ label }}", "", answer_choices="{{ ['a', 'b'] | choice }} ||| c")
+    analysis = template.get_analysis()
+    assert not analysis.deterministic
+    assert analysis.fixed_answer_choices is None and analysis.num_answer_choices is None
+    template = Template("test", "{{ text }} ||| {{ label }}", "", answer_choices="{{ ['a', 'b'] | random }} ||| c")
+    analysis = template.get_analysis()
+    assert not analysis.deterministic and not template.is_deterministic()
+    assert analysis.fixed_answer_choices is None and analysis.num_answer_choices is None
+    assert not Template("test", "{{ [text, 'x'] | random }} ||| {{ label }}", "").is_deterministic()
+
+
+@pytest.mark.parametrize("filter_name", ["choice", "random"])
+def test_seeded_choice_is_reproducible(filter_name):
+    template = Template("test", "{{ ['a', 'b', 'c', 'd', 'e', 'f'] | %s }} {{ text }} ||| {{ label }}" % filter_name, "")
+    example = {"text": "x", "label": 0}
+
+    prompts = [template.apply(example, seed=seed)[0] for seed in range(20)]
+    assert [template.apply(example, seed=seed)[0] for seed in range(20)] == prompts
+    assert len(set(prompts)) > 1
+
+    batch = {"text": ["x"] * 20, "label": [0] * 20}
+    assert template.apply_batch(batch, seeds=list(range(20)))["inputs"] == prompts
+    # The indices passed by Dataset.map(with_indices=True) are not taken for truncate
+    with pytest.raises(TypeError):
+        template.apply_batch(batch, list(range(20)))
+
+    # The generator is local, so the global one does not change the prompts
+    random.seed(0)
+    assert template.apply(example, seed=3)[0] == prompts[3]
+
+
+def test_apply_only_escapes_referenced_variables():
+    template = Template(
+        "test",
+        "{{ question }} {{ zip([1], [2]) | list }} ||| {{ answer_choices[label] }}",
+        "",
+        answer_choices="{{ a }} ||| {{ b }}",
+    )
+    assert template.get_referenced_variables() == {"question", "a", "b", "label"}
+
+    class Unescapable(str):
+        def replace(self, *args):
+            raise AssertionError("Unreferenced fields should not be escaped")
+
+    example = {"question": "q |||", "context": Unescapable("c |||"), "a": "x", "b": "y", "label": 1}
+    assert template.apply(example) == ["q ||| [(1, 2)]", "y"]
+
+    batch = {key: [value] for key, value in example.items()}
+    assert template.apply_batch(batch) == {"inputs": ["q ||| [(1, 2)]"], "targets": ["y"]}
+
+
+def test_apply_reads_hyphenated_fields():
+    template = Template("test", "{{ first_sentence }} ||| {{ label }}", "")
+    assert template.apply({"first-sentence": "a", "label": 1, "other-field": "b"}) == ["a", "1"]
+    assert template.apply({"first_sentence": "c", "label": 0}) == ["c", "0"]
+    assert template.apply_batch({"first-sentence": ["d"], "label": [1]}) == {"inputs": ["d"], "targets": ["1"]}
+
+    # Fields missing from the previous examples are found under their hyphenated key
+    template = Template("test", "{{ first_sentence }} {{ second_sentence }} ||| {{ label }}", "")
+    assert template.apply({"first_sentence": "a", "label": 1}) == ["a", "1"]
+    assert template.apply({"first_sentence": "a", "second-sentence": "b", "label": 1}) == ["a b", "1"]
+
+    render_cache = RenderCache()
+    assert render_cache.apply(template, {"first-sentence": "e", "label": 1}) == ["e", "1"]
+    assert render_cache.apply(template, {"first-sentence": "f", "label": 1}) == ["f", "1"]
+
+
+def test_render_cache(tmp_path):
+    template = Template("test", "{{ text }} ||| {{ answer_choices[label] }}", "", answer_choices="no ||| yes")
+    example = {"text": "a", "label": 1, "unused": object()}
+    render_cache = RenderCache(maxsize=2, use_disk=True, path=str(tmp_path / "renders.sqlite"))
+
+    assert render_cache.apply(template, example) == ["a", "yes"]
+    assert render_cache.apply(template, example) == ["a", "yes"]
+    assert (render_cache.hits, render_cache.misses) == (1, 1)
+
+    # Editing the template changes the key
+    template.jinja = "{{ text }}! ||| {{ answer_choices[label] }}"
+    assert render_cache.apply(template, example) == ["a!", "yes"]
+    assert render_cache.apply(template, example, truncate=False) == ["a!", "yes"]
+    assert len(render_cache) == 2
+    assert (render_cache.hits, render_cache.misses) == (1, 3)
+
+    # The evicted prompt is still on disk
+    template.jinja = "{{ text }} ||| {{ answer_choices[label] }}"
+    assert render_cache.apply(template, example) == ["a", "yes"]
+    assert (render_cache.hits, render_cache.misses) == (2, 3)
+
+    other_process_cache = RenderCache(use_disk=True, path=str(tmp_path / "renders.sqlite"))
+    assert other_process_cache.apply(template, example) == ["a", "yes"]
+    assert other_process_cache.hits == 1
+
+
+@pytest.mark.parametrize("filter_name", ["choice", "random"])
+def test_render_cache_skips_random_templates(filter_name):
+    template = Template("test", "{{ ['a', 'b'] | %s }} {{ text }} ||| {{ label }}" % filter_name, "")
+    render_cache = RenderCache()
+
+    render_cache.apply(template, {"text": "x", "label": 0})
+    assert len(render_cache) == 0
+    render_cache.apply(template, {"text": "x", "label": 0}, seed=0)
+    assert len(render_cache) == 1
+
+    # Seeded prompts are cached per seed
+    prompts = {render_cache.apply(template, {"text": "x", "label": 0}, seed=seed)[0] for seed in range(20)}
+    assert prompts == {"a x", "b x"}
+
+
+def test_bytecode_cache(tmp_path, monkeypatch):
+    env = promptsource.templates.env
+    monkeypatch.setattr(env, "bytecode_cache", None)
+    promptsource.templates.enable_bytecode_cache(str(tmp_path / "bytecode"))
+
+    source = "{{ text }} ||| bytecode cache test"
+    assert promptsource.templates._load_template(source).render(text="a") == "a ||| bytecode cache test"
+    assert len(os.listdir(tmp_path / "bytecode")) == 1
+
+    def compile(*args, **kwargs):
+        raise AssertionError("The compiled code should be loaded from the bytecode cache")
+
+    monkeypatch.setattr(env, "compile", compile)
+    assert promptsource.templates._load_template(source).render(text="b") == "b ||| bytecode cache test"
+
+    # The code compiled by other versions of promptsource is not loaded
+    monkeypatch.setattr(promptsource.templates, "BYTECODE_VERSION", promptsource.templates.BYTECODE_VERSION + 1)
+    with pytest.raises(AssertionError):
+        promptsource.templates._load_template(source)
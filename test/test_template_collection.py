@@ -0,0 +1,250 @@
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow.parquet as pq
+import pytest
+
+import promptsource.templates
+from promptsource.templates import (
+    DatasetTemplates,
+    Template,
+    TemplateCollection,
+    TemplateStore,
+    get_templates_data_frame,
+    iter_template_records,
+    write_template_store,
+    write_templates_parquet,
+)
+
+
+@pytest.fixture
+def templates_folder(tmp_path, monkeypatch):
+    """
+    Sets up a templates folder with a dataset and a dataset with a subset, and an
+    empty cache folder
+    """
+    monkeypatch.setattr(promptsource.templates, "TEMPLATES_FOLDER_PATH", str(tmp_path / "templates"))
+    monkeypatch.setattr(promptsource.templates, "DEFAULT_PROMPTSOURCE_CACHE_HOME", str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "templates")
+
+    for dataset_name, subset_name in [("dummy", None), ("other", "subset")]:
+        dataset_templates = DatasetTemplates(dataset_name, subset_name)
+        dataset_templates.add_template(Template("first", "{{ text }} ||| {{ label }}", "", answer_choices="a ||| b"))
+        dataset_templates.add_template(Template("second", "{{ label }} ||| {{ text }}", ""))
+
+    return tmp_path
+
+
+def test_collection_is_loaded_from_index(templates_folder, monkeypatch):
+    template_collection = TemplateCollection()
+    assert sorted(template_collection.keys, key=str) == [("dummy", None), ("other", "subset")]
+    assert template_collection.get_templates_count() == {"dummy": 2, "other": 2}
+    assert os.path.exists(template_collection.index_path)
+
+    def fail(yaml_path):
+        raise AssertionError(f"{yaml_path} should be read from the index")
+
+    monkeypatch.setattr(promptsource.templates, "_read_templates_file", fail)
+    template_collection = TemplateCollection()
+    dataset_templates = template_collection.get_dataset("other", "subset")
+    assert dataset_templates.all_template_names == ["first", "second"]
+    assert dataset_templates["first"].apply({"text": "x", "label": 1}) == ["x", "1"]
+
+
+def test_collection_reparses_changed_files(templates_folder):
+    TemplateCollection()
+
+    # Makes sure the modification time changes
+    time.sleep(0.01)
+    DatasetTemplates("dummy").add_template(Template("third", "{{ text }} ||| {{ text }}", ""))
+
+    template_collection = TemplateCollection()
+    assert template_collection.get_dataset("dummy").all_template_names == ["first", "second", "third"]
+    assert template_collection.get_dataset("other", "subset").all_template_names == ["first", "second"]
+
+
+def test_collection_materializes_datasets_lazily(templates_folder):
+    template_collection = TemplateCollection()
+    assert template_collection.datasets_templates._datasets_templates == {}
+    assert "('dummy', None)" in repr(template_collection.datasets_templates)
+    assert template_collection.datasets_templates._datasets_templates == {}
+
+    dataset_templates = template_collection.get_dataset("dummy")
+    assert template_collection.get_dataset("dummy") is dataset_templates
+    assert list(template_collection.datasets_templates._datasets_templates) == [("dummy", None)]
+
+    template_collection.remove("dummy")
+    assert template_collection.keys == [("other", "subset")]
+    assert len(template_collection) == 1
+
+
+def test_collection_analysis_table(templates_folder, monkeypatch):
+    TemplateCollection()
+
+    def fail(source):
+        raise AssertionError("Analyses should be read from the index")
+
+    monkeypatch.setattr(promptsource.templates, "_read_templates_file", fail)
+    monkeypatch.setattr(promptsource.templates.env, "parse", fail)
+    template_collection = TemplateCollection()
+
+    rows = sorted(template_collection.get_analysis_table(template_name="first"), key=lambda row: row["dataset_name"])
+    assert [(row["dataset_name"], row["subset_name"]) for row in rows] == [("dummy", None), ("other", "subset")]
+    assert rows[0]["variables"] == {"text", "label"}
+    assert rows[0]["fixed_answer_choices"] == ("a", "b") and rows[0]["num_answer_choices"] == 2
+    assert rows[0]["deterministic"]
+    assert len(template_collection.get_analysis_table(variables="text", subset_name="subset")) == 2
+    assert template_collection.get_analysis_table(filters="choice") == []
+
+    # Loaded templates reuse the analyses of the index
+    template = template_collection.get_dataset("dummy")["first"]
+    assert template.get_referenced_variables() == {"text", "label"}
+    assert template.get_fixed_answer_choices_list() == ["a", "b"]
+
+
+def test_collection_records(templates_folder):
+    records = sorted(iter_template_records(), key=lambda record: record["dataset"])
+    assert [(record["dataset"], record["subset"], record["name"]) for record in records] == [
+        ("dummy", None, "first"),
+        ("dummy", None, "second"),
+        ("other", "subset", "first"),
+        ("other", "subset", "second"),
+    ]
+    assert records[0]["answer_choices"] == "a ||| b" and records[0]["jinja"] == "{{ text }} ||| {{ label }}"
+
+    data_frame = get_templates_data_frame()
+    assert data_frame.shape == (4, 11)
+    assert sorted(data_frame["id"]) == sorted(record["id"] for record in records)
+
+    # Records are written by row groups of row_group_size templates
+    path = str(templates_folder / "templates.parquet")
+    assert write_templates_parquet(path, row_group_size=3) == 4
+    assert pq.ParquetFile(path).num_row_groups == 2
+    table = pq.read_table(path)
+    assert sorted(table.to_pylist(), key=lambda record: record["dataset"]) == records
+
+
+def apply_stored_template(store, template_id):
+    return store.get_template(template_id).apply({"text": "hello", "label": "world"})
+
+
+def test_collection_store(templates_folder, monkeypatch):
+    path = str(templates_folder / "templates.store")
+    assert write_template_store(path) == 4
+    template_id = DatasetTemplates("dummy")["first"].get_id()
+
+    def fail(source):
+        raise AssertionError("Templates should be read from the store")
+
+    monkeypatch.setattr(promptsource.templates, "_read_templates_file", fail)
+    monkeypatch.setattr(promptsource.templates.env, "parse", fail)
+    store = TemplateStore(path)
+    template_collection = TemplateCollection(store=store)
+    assert sorted(template_collection.keys, key=str) == [("dummy", None), ("other", "subset")]
+    assert not template_collection.datasets_templates.is_loaded(("dummy", None))
+    assert len(template_collection.get_analysis_table(variables="text")) == 4
+
+    dataset_templates = template_collection.get_dataset("dummy")
+    assert dataset_templates.all_template_names == ["first", "second"]
+    assert dataset_templates["first"].get_fixed_answer_choices_list() == ["a", "b"]
+    assert len(store) == 4 and template_id in store
+    assert store.get_template(template_id).get_referenced_variables() == {"text", "label"}
+
+    # Processes attach to the file of the store
+    assert pickle.loads(pickle.dumps(store)).path == path
+    monkeypatch.undo()
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(apply_stored_template, store, template_id).result() == ["hello", "world"]
+    store.close()
+
+    with open(path, "r+b") as store_file:
+        store_file.write(b"NOTSTORE")
+    with pytest.raises(ValueError):
+        TemplateStore(path)
+
+
+def test_collection_indexes(templates_folder, monkeypatch):
+    metadata = Template.Metadata(original_task=True, metrics=["Accuracy"], languages=["en"])
+    DatasetTemplates("dummy").add_template(Template("third", "{{ label }}? ||| {{ text }}", "", metadata=metadata))
+    template_collection = TemplateCollection()
+    third_id = template_collection.index.get_id("dummy", None, "third")
+    assert template_collection.get_templates_ids(metric="Accuracy", language="en") == {third_id}
+    assert template_collection.get_templates_ids(metric="Accuracy", language="fr") == set()
+    assert len(template_collection.get_templates_ids()) == 5
+
+    # Templates are looked up without loading the other datasets
+    assert template_collection.get_template(third_id).get_name() == "third"
+    assert template_collection.get_template_by_name("other", "first", "subset").get_name() == "first"
+    assert template_collection.datasets_templates.is_loaded(("dummy", None))
+    assert template_collection.get_templates_count() == {"dummy": 3, "other": 2}
+
+    # Indexes are updated by the changes of the templates
+    dataset_templates = template_collection.get_dataset("other", "subset")
+    french = Template.Metadata(original_task=False, metrics=["Accuracy"], languages=["fr"])
+    dataset_templates.update_template("first", "premier", "{{ text }} ||| {{ label }}", "", french, None)
+    first_id = dataset_templates["premier"].get_id()
+    assert template_collection.get_templates_ids(metric="Accuracy") == {first_id, third_id}
+    assert template_collection.get_templates_ids(language="fr", original_task=False) == {first_id}
+    assert template_collection.get_template_by_name("other", "premier", "subset").get_id() == first_id
+    with pytest.raises(KeyError):
+        template_collection.get_template_by_name("other", "first", "subset")
+
+    dataset_templates.remove_template("premier")
+    assert template_collection.get_templates_ids(metric="Accuracy") == {third_id}
+    assert dataset_templates.all_template_names == ["second"]
+    template_collection.remove("dummy")
+    assert template_collection.get_templates_ids(metric="Accuracy") == set()
+    assert template_collection.get_templates_count() == {"other": 1}
+
+
+def test_collection_indexes_metadata_edited_in_place(templates_folder):
+    metadata = Template.Metadata(original_task=True, metrics=["Accuracy"], languages=["en"])
+    DatasetTemplates("dummy").add_template(Template("third", "{{ label }}? ||| {{ text }}", "", metadata=metadata))
+    template_collection = TemplateCollection()
+    third_id = template_collection.index.get_id("dummy", None, "third")
+    assert template_collection.get_templates_ids(metric="Accuracy") == {third_id}
+
+    # As in the app, the metadata of the template are edited before it is updated, and the
+    # index must forget the values they had when the template was last indexed
+    dataset_templates = template_collection.get_dataset("dummy", None)
+    for metric, language, original_task in [("BLEU", "fr", False), ("ROUGE", "de", None)]:
+        metadata = dataset_templates["third"].metadata
+        metadata.original_task = original_task
+        metadata.metrics[:] = [metric]
+        metadata.languages.append(language)
+        metadata.languages.pop(0)
+        dataset_templates.update_template("third", "third", "{{ label }}? ||| {{ text }}", "", metadata, None)
+        assert template_collection.get_templates_ids(metric=metric, language=language) == {third_id}
+    assert template_collection.get_templates_ids(metric="Accuracy") == set()
+    assert template_collection.get_templates_ids(metric="BLEU") == set()
+    assert template_collection.get_templates_ids(language="fr") == set()
+    assert third_id not in template_collection.get_templates_ids(original_task=False)
+
+
+def test_collection_select(templates_folder):
+    english = Template.Metadata(original_task=True, choices_in_prompt=False, metrics=["Accuracy"], languages=["en"])
+    DatasetTemplates("dummy").add_template(Template("third", "{{ label }}? ||| {{ text }}", "", metadata=english))
+    french = Template.Metadata(original_task=True, choices_in_prompt=True, metrics=["BLEU"], languages=["fr"])
+    DatasetTemplates("other", "subset").add_template(
+        Template("fourth", "{{ text }}? ||| {{ label }}", "", metadata=french, answer_choices="oui ||| non")
+    )
+    template_collection = TemplateCollection()
+
+    selection = template_collection.select(original_task=True)
+    assert not any(template_collection.datasets_templates.is_loaded(key) for key in template_collection.keys)
+    assert [(dataset_name, subset_name, template.get_name()) for dataset_name, subset_name, template in selection] == [
+        ("dummy", None, "third"),
+        ("other", "subset", "fourth"),
+    ]
+
+    def select_names(**conditions):
+        return [template.get_name() for _, _, template in template_collection.select(**conditions)]
+
+    assert select_names(languages=["en", "fr"], metrics="BLEU") == ["fourth"]
+    assert select_names(has_fixed_choices=True) == ["first", "first", "fourth"]
+    assert select_names(has_fixed_choices=True, choices_in_prompt=True) == ["fourth"]
+    assert select_names(dataset_name="other") == ["first", "fourth", "second"]
+    assert select_names(dataset_name="other", subset_name="subset", languages=["en"]) == []
+    assert len(select_names()) == 6
@@ -1,8 +1,8 @@
-import time
 from jinja2 import meta, TemplateError
 import pytest
+import warnings
 import promptsource.templates
-from promptsource.utils import get_dataset_builder
+from promptsource.schemas import SchemaSnapshot
 from uuid import UUID
 
 # Sets up Jinja environment
@@ -12,6 +12,25 @@ env = promptsource.templates.env
 template_collection = promptsource.templates.TemplateCollection()
 
 
+@pytest.fixture(scope="module")
+def schemas():
+    """
+    Snapshot of the dataset schemas (see `promptsource snapshot-schemas`), so that the
+    validation runs offline. Missing schemas are loaded in parallel and saved once.
+
+    :return: the snapshot, and the set of the datasets whose schemas could not be loaded
+    """
+    snapshot = SchemaSnapshot()
+    missing = [key for key in template_collection.keys if key not in snapshot]
+    failed = []
+    if missing:
+        failed = snapshot.update(missing)
+        snapshot.save()
+    if failed:
+        warnings.warn(f"Unable to load the schemas of {len(failed)} datasets: {failed}")
+    return snapshot, set(failed)
+
+
 def test_uuids():
     """
     Checks that all UUIDs across promptsource are unique. (Although collisions
@@ -38,7 +57,7 @@ def test_uuids():
 
 
 @pytest.mark.parametrize("dataset", template_collection.keys)
-def test_dataset(dataset):
+def test_dataset(dataset, schemas):
     """
     Validates all the templates in the repository with simple syntactic checks:
     0. Are all templates parsable YAML?
@@ -49,27 +68,18 @@ def test_dataset(dataset):
     5. Is the UUID valid?
 
     :param dataset: (dataset_name, subset_name) pair to test
+    :param schemas: snapshot of the dataset schemas
 
     """
     dataset_name, subset_name = dataset
 
     # Loads dataset information
-    tries = 0
-    max_tries = 3
-    while True:
-        try:
-            builder_instance = get_dataset_builder(dataset_name, subset_name)
-            break
-        except ConnectionError as e:
-            if tries < max_tries:
-                time.sleep(2)
-                tries += 1
-            else:
-                raise e
-
-    has_features = builder_instance.info.features is not None
+    snapshot, failed = schemas
+    if dataset in failed:
+        pytest.fail(f"Unable to load the schema of dataset {dataset_name}/{subset_name}, see the logged error.")
+    features = snapshot.get_columns(dataset_name, subset_name)
+    has_features = features is not None
     if has_features:
-        features = builder_instance.info.features.keys()
         features = set([feature.replace("-", "_") for feature in features])
 
     # Initializes sets for checking uniqueness among templates
@@ -0,0 +1,278 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import datasets
+import pytest
+import requests
+
+import promptsource.utils
+from promptsource.templates import DatasetTemplates, Template
+from promptsource.utils import (
+    StreamingExamples,
+    fetch_hub_datasets,
+    filter_english_datasets,
+    project_dataset,
+    renameDatasetColumn,
+)
+
+
+PAGES = [
+    [{"id": "english", "cardData": {"language": ["en"]}}, {"id": "french", "cardData": {"language": ["fr"]}}],
+    [{"id": "Zaid/community"}, {"id": "other/community"}, {"id": "no_card"}],
+    [{"id": "american", "cardData": {"language": "en-US"}}],
+]
+
+
+@pytest.fixture
+def hub_server():
+    """
+    Serves PAGES with cursor-based pagination on a local server, failing the first request
+    to each page with a 503 and the first request to page 2 with a 404 if requested.
+    Returns the URL of the first page, the list of the requested paths and the settings.
+    """
+    requested = []
+    settings = {"fail_page": None}
+    unavailable = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            page = int(self.path.split("page=")[1])
+            if self.path not in unavailable:
+                unavailable.add(self.path)
+                self.send_response(503)
+                self.end_headers()
+                return
+            if page == settings["fail_page"]:
+                settings["fail_page"] = None
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            body = json.dumps(PAGES[page]).encode("utf-8")
+            self.send_response(200)
+            if page + 1 < len(PAGES):
+                url = f"http://127.0.0.1:{self.server.server_port}/api/datasets?page={page + 1}"
+                self.send_header("Link", f'<{url}>; rel="next"')
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/api/datasets?page=0", requested, settings
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_hub_datasets(hub_server, tmp_path, monkeypatch):
+    api_url, requested, settings = hub_server
+    snapshot_path = str(tmp_path / "hub_datasets.json")
+
+    # Interrupted fetches resume from the last fetched page
+    get_page_datasets = promptsource.utils._get_page_datasets
+
+    def interrupt(page):
+        if page == PAGES[2]:
+            raise KeyboardInterrupt
+        return get_page_datasets(page)
+
+    monkeypatch.setattr("promptsource.utils._get_page_datasets", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        fetch_hub_datasets(api_url, snapshot_path)
+    monkeypatch.setattr("promptsource.utils._get_page_datasets", get_page_datasets)
+    del requested[:]
+    datasets_metadata = fetch_hub_datasets(api_url, snapshot_path)
+    assert requested == ["/api/datasets?page=2"]
+    assert [dataset_name for dataset_name, _ in datasets_metadata] == [
+        "english",
+        "french",
+        "Zaid/community",
+        "other/community",
+        "no_card",
+        "american",
+    ]
+
+    # The snapshot is used until it is older than ttl, and whatever its age offline
+    del requested[:]
+    assert fetch_hub_datasets(api_url, snapshot_path) == datasets_metadata
+    assert fetch_hub_datasets(api_url, snapshot_path, ttl=0, offline=True) == datasets_metadata
+    assert requested == []
+    assert fetch_hub_datasets(api_url, snapshot_path, ttl=0) == datasets_metadata
+    assert requested == [f"/api/datasets?page={page}" for page in range(3)]
+
+    with pytest.raises(FileNotFoundError):
+        fetch_hub_datasets(api_url, str(tmp_path / "missing.json"), offline=True)
+
+    # Fetches are not resumed after an HTTP error, nor when they started more than ttl ago
+    other_snapshot_path = str(tmp_path / "other.json")
+    settings["fail_page"] = 2
+    with pytest.raises(requests.HTTPError):
+        fetch_hub_datasets(api_url, other_snapshot_path)
+    del requested[:]
+    assert fetch_hub_datasets(api_url, other_snapshot_path) == datasets_metadata
+    assert requested == [f"/api/datasets?page={page}" for page in range(3)]
+
+    monkeypatch.setattr("promptsource.utils._get_page_datasets", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        fetch_hub_datasets(api_url, other_snapshot_path, ttl=0)
+    monkeypatch.setattr("promptsource.utils._get_page_datasets", get_page_datasets)
+    del requested[:]
+    assert fetch_hub_datasets(api_url, other_snapshot_path, ttl=0) == datasets_metadata
+    assert requested == [f"/api/datasets?page={page}" for page in range(3)]
+    assert sorted(os.listdir(tmp_path)) == ["hub_datasets.json", "other.json"]
+
+    # The datasets are listed even if the snapshot cannot be written
+    (tmp_path / "file").write_text("")
+    assert fetch_hub_datasets(api_url, str(tmp_path / "file" / "hub_datasets.json")) == datasets_metadata
+
+    monkeypatch.setattr("promptsource.utils.HUB_DATASETS_API_URL", api_url)
+    monkeypatch.setattr("promptsource.utils.HUB_SNAPSHOT_PATH", snapshot_path)
+    assert filter_english_datasets(offline=True) == ["Zaid/community", "american", "english"]
+
+
+class LegacyDataset:
+    """
+    Dataset of older versions of datasets, which can neither select columns nor rename
+    several columns at once
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.column_names = dataset.column_names
+
+    def __getitem__(self, key):
+        return self.dataset[key]
+
+    def rename_column(self, column, new_column):
+        return LegacyDataset(self.dataset.rename_column(column, new_column))
+
+    def remove_columns(self, columns):
+        return LegacyDataset(self.dataset.remove_columns(columns))
+
+
+def test_rename_dataset_column():
+    dataset = datasets.Dataset.from_dict({"first-sentence": ["a"], "second-sentence": ["b"], "label": [0]})
+    renamed = renameDatasetColumn(dataset)
+    assert renamed.column_names == ["first_sentence", "second_sentence", "label"]
+    assert renameDatasetColumn(renamed) is renamed
+    assert renameDatasetColumn(LegacyDataset(dataset)).column_names == ["first_sentence", "second_sentence", "label"]
+
+
+def test_project_dataset():
+    first = Template("first", "{{ premise }} ||| {{ label }}", "", answer_choices="{{ first_choice }} ||| no")
+    second = Template("second", "{{ hypothesis }} ||| {{ label }}", "")
+    dataset_templates = DatasetTemplates("dummy", templates={first.get_id(): first, second.get_id(): second})
+    variables = dataset_templates.get_referenced_variables(["first"])
+    assert variables == {"premise", "label", "first_choice"}
+
+    dataset = datasets.Dataset.from_dict(
+        {"premise": ["a"], "hypothesis": ["b"], "first-choice": ["c"], "image": ["d"], "label": [0]}
+    )
+    projected = project_dataset(datasets.DatasetDict({"train": dataset}), variables)
+    assert projected["train"].column_names == ["premise", "first-choice", "label"]
+    assert first.apply(projected["train"][0]) == ["a", "0"]
+    projected = project_dataset(LegacyDataset(dataset), variables)
+    assert projected.column_names == ["premise", "first-choice", "label"]
+    assert first.apply(projected[0]) == ["a", "0"]
+
+    # Streamed datasets are projected too, if their columns are known
+    if hasattr(dataset, "to_iterable_dataset"):
+        streamed = project_dataset(dataset.to_iterable_dataset(), dataset_templates.get_referenced_variables())
+        assert list(next(iter(streamed))) == ["premise", "hypothesis", "first-choice", "label"]
+
+
+class IterableExamples:
+    """Streamed dataset of older versions of datasets, whose columns are not known"""
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def __iter__(self):
+        return self.generator()
+
+    def map(self, function):
+        return IterableExamples(lambda: (function(example) for example in self.generator()))
+
+
+def test_rename_streamed_dataset_column():
+    def stream():
+        yield {"first-sentence": "a", "label": 0}
+        yield {"first-sentence": "b", "label": 1}
+
+    renamed = renameDatasetColumn(IterableExamples(stream))
+    examples = StreamingExamples(renamed, max_buffered=4, prefetch=2)
+    assert examples.get(0, 3) == [{"first_sentence": "a", "label": 0}, {"first_sentence": "b", "label": 1}]
+    examples.close()
+
+
+def test_streaming_examples():
+    read = []
+
+    def stream():
+        for idx in range(10):
+            read.append(idx)
+            yield {"idx": idx}
+
+    examples = StreamingExamples(IterableExamples(stream), max_buffered=4, prefetch=2)
+    assert [example["idx"] for example in examples.get(2, 5)] == [2, 3, 4]
+    assert examples[3] == {"idx": 3}
+    assert examples.length is None
+
+    # Examples which are not buffered anymore are read again from the start
+    assert [example["idx"] for example in examples.get(6, 12)] == [6, 7, 8, 9]
+    assert examples.length == 10
+    read.clear()
+    assert examples[0] == {"idx": 0}
+    assert read[0] == 0
+    with pytest.raises(IndexError):
+        examples[10]
+    examples.close()
+
+    # Closing a stream stops its reader, blocked on the full queue, and the buffered examples
+    # are still accessed without reading the stream again
+    examples = StreamingExamples(IterableExamples(stream), max_buffered=4, prefetch=2)
+    assert examples[1] == {"idx": 1}
+    thread = examples._thread
+    examples.close()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    read.clear()
+    assert examples[1] == {"idx": 1}
+    assert read == []
+    assert [example["idx"] for example in examples.get(1, 4)] == [1, 2, 3]
+    examples.close()
+
+    # Errors of the stream, even those which are not exceptions, end the examples
+    def failing_stream():
+        yield {"idx": 0}
+        raise SystemExit
+
+    examples = StreamingExamples(IterableExamples(failing_stream), max_buffered=4, prefetch=2)
+    with pytest.raises(SystemExit):
+        examples.get(0, 2)
+    examples.close()
+
+    # Closing a stream closes the iterator of the dataset too
+    closed = []
+
+    def closable_stream():
+        try:
+            for idx in range(10):
+                yield {"idx": idx}
+        finally:
+            closed.append(True)
+
+    examples = StreamingExamples(IterableExamples(closable_stream), max_buffered=4, prefetch=2)
+    assert examples[0] == {"idx": 0}
+    thread = examples._thread
+    examples.close()
+    thread.join(timeout=5)
+    assert closed == [True]
@@ -0,0 +1,74 @@
+import glob
+import os
+import time
+
+import pytest
+import yaml
+
+import promptsource.templates
+from promptsource.templates import YAML_LOADER, Template
+
+
+yaml_paths = sorted(
+    glob.glob(os.path.join(promptsource.templates.TEMPLATES_FOLDER_PATH, "**", "templates.yaml"), recursive=True)
+)
+
+
+def load_all(loader):
+    """
+    Loads all the templates.yaml files with a YAML loader
+
+    :return: tuple of the loading time in seconds and the loaded templates, keyed by file
+    """
+    start = time.perf_counter()
+    loaded = {yaml_path: promptsource.templates._read_templates_file(yaml_path, loader) for yaml_path in yaml_paths}
+    return time.perf_counter() - start, loaded
+
+
+def as_dict(template):
+    state = template.__getstate__()
+    state["metadata"] = state["metadata"].__getstate__()
+    return state
+
+
+@pytest.mark.skipif(YAML_LOADER is yaml.FullLoader, reason="PyYAML is not built with libyaml")
+def test_libyaml_loader_matches_python_loader():
+    """
+    Checks that the pure Python loader and the libyaml-backed one load the same templates
+    from the whole templates tree.
+    """
+    _, python_loaded = load_all(yaml.FullLoader)
+    _, c_loaded = load_all(YAML_LOADER)
+
+    for yaml_path in yaml_paths:
+        python_templates = {key: as_dict(template) for key, template in python_loaded[yaml_path].items()}
+        c_templates = {key: as_dict(template) for key, template in c_loaded[yaml_path].items()}
+        assert python_templates == c_templates, yaml_path
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(YAML_LOADER is yaml.FullLoader, reason="PyYAML is not built with libyaml")
+def test_libyaml_loader_benchmark():
+    """
+    Compares the loading times of the whole templates tree with the pure Python loader
+    and the libyaml-backed one. Run with `pytest -m benchmark`.
+    """
+    python_time, _ = load_all(yaml.FullLoader)
+    c_time, _ = load_all(YAML_LOADER)
+    assert c_time < python_time, f"{YAML_LOADER.__name__} took {c_time:.2f}s, FullLoader {python_time:.2f}s"
+
+
+def test_template_yaml_round_trip():
+    template = Template("name", "{{ text }} ||| {{ label }}", "", answer_choices="No ||| Yes")
+    template.metadata.metrics = ["Accuracy"]
+    assert not hasattr(template, "__dict__") and not hasattr(template.metadata, "__dict__")
+
+    # Keys unknown to Template are written back
+    yaml_text = yaml.dump(template).replace("reference: ''", "reference: ''\ntask_template: true")
+    first, second = yaml.load(yaml_text, Loader=YAML_LOADER), yaml.load(yaml_text, Loader=YAML_LOADER)
+    assert yaml.dump(first) == yaml_text
+    assert first.__getstate__()["task_template"] is True
+
+    # Strings repeated across templates are shared
+    assert first.answer_choices == "No ||| Yes" and first.answer_choices is second.answer_choices
+    assert first.metadata.metrics[0] is second.metadata.metrics[0]